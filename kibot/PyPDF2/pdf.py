@@ -46,6 +46,8 @@ import math
 import struct
 import sys
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from os import cpu_count
 from sys import version_info
 if version_info < ( 3, 0 ):
     from cStringIO import StringIO
@@ -1069,6 +1071,8 @@ class PdfFileReader(object):
             warnings.showwarning = _showwarning
         self.strict = strict
         self.flattenedPages = None
+        # Pages found without flattening the pages tree
+        self._lazyPages = {}
         self.resolvedObjects = {}
         self.xrefIndex = 0
         self._pageId2Num = None # map page IndirectRef number to Page Number
@@ -1149,6 +1153,16 @@ class PdfFileReader(object):
                 self._override_encryption = False
         else:
             if self.flattenedPages == None:
+                # Avoid reading all the pages when the tree has a valid count.
+                # The count is trusted only if we can find the last page.
+                count = self.trailer["/Root"].getObject()["/Pages"].getObject().get("/Count")
+                if isinstance(count, NumberObject) and count >= 0:
+                    if count == 0:
+                        return count
+                    last = self._lazyPages.get(count - 1) or self._findPage(count - 1)
+                    if last is not None:
+                        self._lazyPages[count - 1] = last
+                        return count
                 self._flatten()
             return len(self.flattenedPages)
 
@@ -1170,9 +1184,69 @@ class PdfFileReader(object):
         ## ensure that we're not trying to access an encrypted PDF
         #assert not self.trailer.has_key("/Encrypt")
         if self.flattenedPages == None:
+            page = self._lazyPages.get(pageNumber)
+            if page is None and pageNumber >= 0:
+                page = self._findPage(pageNumber)
+            if page is not None:
+                self._lazyPages[pageNumber] = page
+                return page
+            # Negative index or inconsistent page counts, use the whole tree
             self._flatten()
         return self.flattenedPages[pageNumber]
 
+    def _findPage(self, pageNumber):
+        """
+        Looks for a page using the ``/Count`` of the intermediate nodes, so
+        only the objects in the path to the page are read.
+
+        :return: a :class:`PageObject<pdf.PageObject>` instance or ``None``
+            if the page tree doesn't match the page counts.
+        """
+        inheritablePageAttributes = (
+            NameObject("/Resources"), NameObject("/MediaBox"),
+            NameObject("/CropBox"), NameObject("/Rotate")
+            )
+        inherit = dict()
+        indirectRef = None
+        node = self.trailer["/Root"].getObject()["/Pages"].getObject()
+        visited = set()
+        while node.get("/Type", "/Pages") == "/Pages":
+            if id(node) in visited:
+                # Loop in the page tree
+                return None
+            visited.add(id(node))
+            for attr in inheritablePageAttributes:
+                if attr in node:
+                    inherit[attr] = node[attr]
+            for kid in node.get("/Kids", ()):
+                obj = kid.getObject()
+                t = obj.get("/Type", "/Pages")
+                if t == "/Pages":
+                    count = obj.get("/Count")
+                    if not isinstance(count, NumberObject):
+                        return None
+                elif t == "/Page":
+                    count = 1
+                else:
+                    count = 0
+                if pageNumber < count:
+                    node = obj
+                    indirectRef = kid if isinstance(kid, IndirectObject) else None
+                    break
+                pageNumber -= count
+            else:
+                return None
+        if node.get("/Type") != "/Page":
+            return None
+        for attr, value in list(inherit.items()):
+            # if the page has it's own value, it does not inherit the
+            # parent's value:
+            if attr not in node:
+                node[attr] = value
+        pageObj = PageObject(self, indirectRef)
+        pageObj.update(node)
+        return pageObj
+
     namedDestinations = property(lambda self:
                                   self.getNamedDestinations(), None, None)
     """
@@ -2775,6 +2849,61 @@ class ContentStream(DecodedStreamObject):
     _data = property(_getData, _setData)
 
 
+def _hasDirectFilters(stream):
+    for key in ("/Filter", "/DecodeParms"):
+        if isinstance(stream.get(key), IndirectObject):
+            return False
+    return True
+
+
+def _compressStreams(streams):
+    data = b_("\n").join(s.getData() for s in streams)
+    content = DecodedStreamObject()
+    content.setData(data)
+    return content.flateEncode()
+
+
+def compressPagesContentStreams(pages, workers=None):
+    """
+    Compresses the content streams of a list of pages, like calling
+    :meth:`PageObject.compressContentStreams()` for each page, but using a
+    pool of threads. The streams are decoded, joined and Flate-encoded by
+    the workers, most of this work is done by zlib, which releases the GIL.
+
+    The streams are joined without parsing them, so their operations are
+    kept untouched. The objects are read from the PDF by the caller's
+    thread and the results are assigned in the same order, so the output
+    is deterministic.
+
+    :param list pages: the :class:`PageObject` instances to compress.
+    :param int workers: maximum number of threads, the number of CPUs when
+        omitted.
+    """
+    jobs = []
+    for page in pages:
+        content = page.getContents()
+        if content is None:
+            continue
+        if isinstance(content, ContentStream):
+            # Already parsed, we need its operations
+            streams = [content]
+        elif isinstance(content, ArrayObject):
+            streams = [s.getObject() for s in content]
+        else:
+            streams = [content]
+        for s in streams:
+            if not _hasDirectFilters(s):
+                # The filter parameters must be read from the PDF, do it here
+                s.getData()
+        jobs.append((page, streams))
+    if not jobs:
+        return
+    with ThreadPoolExecutor(max_workers=min(workers or cpu_count() or 1, len(jobs))) as executor:
+        results = executor.map(_compressStreams, [streams for _, streams in jobs])
+        for (page, _), content in zip(jobs, results):
+            page[NameObject("/Contents")] = content
+
+
 class DocumentInformation(DictionaryObject):
     """
     A class representing the basic document metadata provided in a PDF File.
@@ -315,6 +315,10 @@ def main():
     else:
         # Do all the job (preflight + outputs)
         generate_outputs(outputs, args.target, args.invert_sel, args.skip_pre, args.cli_order)
+    # Print the filters and variants statistics
+    if GS.global_profile_filters:
+        json_file = GS.global_profile_filters_json
+        logger.log_filters_stats(os.path.join(GS.out_dir, json_file) if json_file else None)
     # Print total warnings
     logger.log_totals()
 
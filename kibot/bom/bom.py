@@ -10,9 +10,8 @@
 All the logic to convert a list of components into the rows and columns used to create the BoM.
 """
 import locale
-from copy import deepcopy
 from math import ceil
-from .units import compare_values, comp_match, get_last_warning
+from .units import compare_values, comp_match, comp_match_list
 from .bom_writer import write_bom
 from .columnlist import ColumnList
 from ..misc import DNF, W_FIELDCONF
@@ -117,6 +116,91 @@ def compare_components(c1, c2, cfg):
     return True
 
 
+class GroupKeys(object):
+    """ Computes a canonical grouping key for each component.
+        Two components with the same key are equal for `compare_components` and components with different keys aren't.
+        When this can't be guaranteed (i.e. an empty field merged with any other) the key is None and the component
+        must be compared using `compare_components` """
+    def __init__(self, cfg, components):
+        self.cfg = cfg
+        # Map each value string to all the numeric values we found for it
+        self.num_values = {}
+        for c in components:
+            self.num_values.setdefault(self.value_str(c), set()).add(self.value_num(c))
+        # Which aliases list contains each part name
+        self.aliases = {}
+        for idx, alias in enumerate(cfg.component_aliases):
+            for name in alias:
+                self.aliases.setdefault(name, set()).add(idx)
+
+    @staticmethod
+    def value_str(c):
+        value = c.value.strip().lower()
+        # '~' is the same as empty for KiCad
+        return '' if value == '~' else value
+
+    @staticmethod
+    def value_num(c):
+        """ Same representation used by `compare_values` """
+        if not c.value_sort:
+            return None
+        (v, (p, ps), u) = c.value_sort
+        return ("{0:.15f}".format(v * 1.0 * p), u)
+
+    def value_key(self, c):
+        if self.cfg.group_connectors and 'connector' in c.lib.lower():
+            # Connectors match any other connector
+            return None
+        s = self.value_str(c)
+        nums = self.num_values[s]
+        if len(nums) > 1:
+            # The same string has different meanings (i.e. 10 for R and C), not transitive
+            return None
+        n = next(iter(nums))
+        return n if n is not None else ('s', s)
+
+    def part_key(self, c):
+        pn = c.name.lower()
+        alias = self.aliases.get(pn)
+        if alias is None:
+            return ('pn', pn)
+        if len(alias) > 1:
+            # Member of more than one aliases list, not transitive
+            return None
+        return ('alias', next(iter(alias)))
+
+    def field_key(self, c, field):
+        value = c.get_field_value(field).lower()
+        if value:
+            return value
+        if self.cfg.merge_blank_fields:
+            # Empty fields matches anything
+            return None
+        # Avoid merging two components with empty field, unless requested
+        return '' if self.cfg.merge_both_blank else object()
+
+    def get_key(self, c):
+        cfg = self.cfg
+        key = [c.fitted, c.fixed]
+        if len(cfg.group_fields) == 0:
+            key.append(c.ref)
+            return tuple(key)
+        for i, field in enumerate(cfg.group_fields):
+            if cfg.group_fields_fallbacks[i] is not None and c.get_field_value(field) == "":
+                # The field used to compare depends on the other component
+                return None
+            if field == ColumnList.COL_VALUE_L:
+                k = self.value_key(c)
+            elif field == ColumnList.COL_PART_L:
+                k = self.part_key(c)
+            else:
+                k = self.field_key(c, field)
+            if k is None:
+                return None
+            key.append(k)
+        return tuple(key)
+
+
 class Joiner:
     def __init__(self):
         self.stack = {}
@@ -162,14 +246,19 @@ def _suffix_to_num(suffix):
 
 class ComponentGroup(object):
     """ A row in the BoM """
+    DEFAULT_FIELDS = {c.lower(): None for c in ColumnList.COLUMNS_DEFAULT}
+
     def __init__(self, cfg):
         """ Initialize the group with no components, and default fields """
         self.components = []
         self.refs = {}
         self.cfg = cfg
         # Columns loaded from KiCad
-        self.fields = {c.lower(): None for c in ColumnList.COLUMNS_DEFAULT}
-        self.field_names = deepcopy(ColumnList.COLUMNS_DEFAULT)
+        self.fields = self.DEFAULT_FIELDS.copy()
+        self.field_names = list(ColumnList.COLUMNS_DEFAULT)
+        # Grouping key of the first component (see GroupKeys) and creation order
+        self.key = None
+        self.index = 0
 
     def match_component(self, c):
         """ Test if a given component fits in this group """
@@ -357,23 +446,55 @@ class ComponentGroup(object):
             self.fields[ColumnList.COL_DESCRIPTION_L] = comp.desc
 
     def get_row(self, columns):
-        """ Return a dict of the KiCad data based on the supplied columns """
-        row = []
-        for key in columns:
-            val = self.get_field(key)
-            # Join fields (appending to current value)
-            for join_l in self.cfg.join:
-                # Each list is "target, source..." so we need at least 2 elements
-                elements = len(join_l)
-                target = join_l[0]
-                if elements > 1 and target == key:
-                    # Append data from the other fields
-                    for source in join_l[1:]:
-                        v = source.get_text(self.get_field)
-                        if v:
-                            val += v
-            row.append(val)
-        return row
+        """ Return a list of the KiCad data based on the supplied columns """
+        fields = self.fields
+        return [getter(fields) for getter in get_row_getters(self.cfg, columns)]
+
+
+def compile_field(key):
+    """ Accessor for a plain field """
+    def getter(fields):
+        return fields.get(key) or ''
+    return getter
+
+
+def compile_joined_field(key, sources):
+    """ Accessor for a field with other fields (or text) appended """
+    parts = []
+    for source in sources:
+        if source.text:
+            parts.append((source.text, None, '', ''))
+        else:
+            separator = '' if source.text_before else ' '
+            parts.append((None, source.field, separator + source.text_before, source.text_after))
+
+    def getter(fields):
+        val = fields.get(key) or ''
+        for text, field, before, after in parts:
+            if text:
+                val += text
+            else:
+                v = fields.get(field)
+                if v:
+                    val += before + v + after
+        return val
+    return getter
+
+
+def get_row_getters(cfg, columns):
+    """ A list of accessors to compute a row, one for each column.
+        They are computed once for each list of columns and cached in the configuration """
+    key = tuple(columns)
+    getters = cfg._row_getters.get(key)
+    if getters is None:
+        getters = []
+        for col in key:
+            # Each join list is "target, source..."
+            sources = [source for join_l in cfg.join if join_l[0] == col for source in join_l[1:]]
+            field = col.lower()
+            getters.append(compile_joined_field(field, sources) if sources else compile_field(field))
+        cfg._row_getters[key] = getters
+    return getters
 
 
 def get_value_sort(comp, fallback_ref=False):
@@ -432,37 +553,68 @@ def compute_multiple_stats(cfg, groups):
                          format(sch.name, sch.comp_total, sch.comp_fitted, sch.comp_build))
 
 
-def group_components(cfg, components):
+def create_groups(cfg, components):
+    """ Iterate through each component, and test whether a group for these already exists.
+        Most components can be grouped using its key, the rest needs a pairwise comparison.
+        The result is the same we get comparing each component against the first component of each group. """
+    keys = GroupKeys(cfg, components)
     groups = []
-    # Iterate through each component, and test whether a group for these already exists
+    groups_by_key = {}
+    fuzzy_groups = []
     for c in components:
-        if not c.included:  # Skip components marked as excluded from BoM
-            continue
-        # Cache the value used to sort
-        if c.ref_prefix in RLC_PREFIX and c.value.lower() not in DNF:
-            c.value_sort = comp_match(c.value, c.ref_prefix, c.ref)
-            if c.value_sort is None and (' ' in c.value):
-                # Try with the data before a space
-                value = c.value.split(' ')[0]
-                value_sort = comp_match(value, c.ref_prefix)
-                if value_sort is not None:
-                    c.value_sort = value_sort
-                    extra = ', only for sorting purposes' if not cfg.normalize_values else ''
-                    logger.warning(get_last_warning() + "Using `{}` for {} instead{}".format(value, c.ref, extra))
+        key = keys.get_key(c)
+        if key is None:
+            candidates = groups
         else:
-            c.value_sort = None
-        # Try to add the component to an existing group
-        found = False
-        for g in groups:
-            if g.match_component(c):
-                g.add_component(c)
-                found = True
+            candidates = fuzzy_groups
+            g = groups_by_key.get(key)
+            if g is not None:
+                # Keep the creation order, the first group that matches wins
+                candidates = [f for f in fuzzy_groups if f.index < g.index] + [g]
+        found = None
+        for g in candidates:
+            if (g.key is not None and g.key == key) or g.match_component(c):
+                found = g
                 break
-        if not found:
+        if found is None:
             # Create a new group
             g = ComponentGroup(cfg)
+            g.index = len(groups)
+            g.key = key
             g.add_component(c)
             groups.append(g)
+            if key is None:
+                fuzzy_groups.append(g)
+            else:
+                groups_by_key[key] = g
+        elif not found.contains_component(c):
+            # Note: repeated components happens when a component contains more than one unit
+            found.components.append(c)
+            found.refs[c.ref+c.project] = c
+    return groups
+
+
+def group_components(cfg, components):
+    # Skip components marked as excluded from BoM
+    components = [c for c in components if c.included]
+    # Cache the value used to sort
+    rlc = []
+    for c in components:
+        c.value_sort = None
+        if c.ref_prefix in RLC_PREFIX and c.value.lower() not in DNF:
+            rlc.append(c)
+    # Parse all the values in one pass, repeated values are parsed only once
+    for c, (value_sort, warn) in zip(rlc, comp_match_list([(c.value, c.ref_prefix, c.ref) for c in rlc])):
+        c.value_sort = value_sort
+        if value_sort is None and (' ' in c.value):
+            # Try with the data before a space
+            value = c.value.split(' ')[0]
+            value_sort = comp_match(value, c.ref_prefix)
+            if value_sort is not None:
+                c.value_sort = value_sort
+                extra = ', only for sorting purposes' if not cfg.normalize_values else ''
+                logger.warning(warn + "Using `{}` for {} instead{}".format(value, c.ref, extra))
+    groups = create_groups(cfg, components)
     # Now unify the data from the components of each group
     decimal_point = None
     if cfg.normalize_locale:
@@ -541,10 +693,8 @@ def smd_tht(cfg, tot, smd, tht):
     return tot
 
 
-def do_bom(file_name, ext, comps, cfg):
-    # Group components according to group_fields
-    groups = group_components(cfg, comps)
-    # Create the BoM
+def do_bom(file_name, ext, groups, cfg):
+    """ Creates the BoM from the groups computed by group_components """
     logger.debug("Saving BOM File: "+file_name)
     number = cfg.number
     cfg.number = sum(map(lambda prj: prj.number, cfg.aggregate))
@@ -11,6 +11,14 @@ CSV Writer: Generates a CSV, TSV or TXT BoM file.
 import csv
 
 
+def get_rows(groups, headings, cfg):
+    """ Generator for the rows of the BoM, computed when needed """
+    for group in groups:
+        if cfg.ignore_dnf and not group.is_fitted():
+            continue
+        yield group.get_row(headings)
+
+
 def write_stats(writer, cfg):
     if len(cfg.aggregate) == 1:
         # Only one project
@@ -92,11 +100,7 @@ def write_csv(filename, ext, groups, headings, head_names, cfg):
         if not cfg.csv.hide_header:
             writer.writerow(head_names)
         # Body
-        for group in groups:
-            if cfg.ignore_dnf and not group.is_fitted():
-                continue
-            row = group.get_row(headings)
-            writer.writerow(row)
+        writer.writerows(get_rows(groups, headings, cfg))
         # PCB info
         if not (cfg.csv.hide_pcb_info and cfg.csv.hide_stats_info):
             # Add some blank rows
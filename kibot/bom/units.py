@@ -45,6 +45,9 @@ match = None
 decimal_point = None
 # Last warning
 last_warning = ''
+# Cache for the parsed values, indexed by (value, ref_prefix, decimal_point)
+CACHE_SIZE = 4096
+parsed_cache = {}
 
 
 def get_last_warning():
@@ -104,20 +107,8 @@ def match_string():
     return r"(\d*\.?\d*)\s*(" + group_string(PREFIX_ALL) + ")*(" + group_string(UNIT_ALL) + r")*(\d*)$"
 
 
-def comp_match(component, ref_prefix, ref=None):
-    """
-    Return a normalized value and units for a given component value string
-    e.g. comp_match('10R2') returns (10, R)
-    e.g. comp_match('3.3mOhm') returns (0.0033, R)
-    """
-    global last_warning
-    original = component
-    # Remove useless spaces
-    component = component.strip()
-    # ~ is the same as empty for KiCad
-    if component == '~':
-        component = ''
-    # Convert the decimal point from the current locale to a '.'
+def get_decimal_point():
+    """ Decimal point from the current locale, empty when is '.' """
     global decimal_point
     if decimal_point is None:
         decimal_point = locale.localeconv()['decimal_point']
@@ -125,8 +116,20 @@ def comp_match(component, ref_prefix, ref=None):
         # Avoid conversions for '.'
         if decimal_point == '.':
             decimal_point = ''
-    if decimal_point:
-        component = component.replace(decimal_point, ".")
+    return decimal_point
+
+
+def parse_value(component, ref_prefix, dec_point):
+    """ Parses a component value.
+        Returns the comp_match() result and, on error, the warning code and the reason """
+    # Remove useless spaces
+    component = component.strip()
+    # ~ is the same as empty for KiCad
+    if component == '~':
+        component = ''
+    # Convert the decimal point from the current locale to a '.'
+    if dec_point:
+        component = component.replace(dec_point, ".")
 
     # Remove any commas
     component = component.strip().replace(",", "")
@@ -137,18 +140,13 @@ def comp_match(component, ref_prefix, ref=None):
         # Ignore case
         match = re.compile(match_string(), flags=re.IGNORECASE)
 
-    where = ' in {}'.format(ref) if ref is not None else ''
     result = match.match(component)
     if not result:
-        last_warning = W_BADVAL1
-        logger.warning(W_BADVAL1 + "Malformed value: `{}` (no match{})".format(original, where))
-        return None
+        return None, W_BADVAL1, 'no match'
 
     value, prefix, units, post = result.groups()
     if value == '.':
-        last_warning = W_BADVAL2
-        logger.warning(W_BADVAL2 + "Malformed value: `{}` (reduced to decimal point{})".format(original, where))
-        return None
+        return None, W_BADVAL2, 'reduced to decimal point'
     if value == '':
         value = '0'
 
@@ -158,10 +156,7 @@ def comp_match(component, ref_prefix, ref=None):
     # We will also have a trailing number
     if post:
         if "." in value:
-            last_warning = W_BADVAL3
-            logger.warning(W_BADVAL3 + "Malformed value: `{}` (unit split, but contains decimal point{})".
-                           format(original, where))
-            return None
+            return None, W_BADVAL3, 'unit split, but contains decimal point'
         value = float(value)
         postValue = float(post) / (10 ** len(post))
         val = value * 1.0 + postValue
@@ -169,7 +164,57 @@ def comp_match(component, ref_prefix, ref=None):
         val = float(value)
 
     # Return all the data, let the caller join it
-    return (val, get_prefix(prefix), get_unit(units, ref_prefix))
+    return (val, get_prefix(prefix), get_unit(units, ref_prefix)), None, None
+
+
+def get_parsed_value(component, ref_prefix, dec_point):
+    """ Cached version of parse_value() """
+    key = (component, ref_prefix, dec_point)
+    res = parsed_cache.get(key)
+    if res is None:
+        res = parse_value(component, ref_prefix, dec_point)
+        if len(parsed_cache) >= CACHE_SIZE:
+            # Discard the oldest entry
+            del parsed_cache[next(iter(parsed_cache))]
+        parsed_cache[key] = res
+    return res
+
+
+def report_value(res, component, ref):
+    """ Returns the value from a parse_value() result, informing any problem """
+    global last_warning
+    value, warn, reason = res
+    if warn is not None:
+        last_warning = warn
+        where = ' in {}'.format(ref) if ref is not None else ''
+        logger.warning(warn + "Malformed value: `{}` ({}{})".format(component, reason, where))
+    return value
+
+
+def comp_match(component, ref_prefix, ref=None):
+    """
+    Return a normalized value and units for a given component value string
+    e.g. comp_match('10R2') returns (10, R)
+    e.g. comp_match('3.3mOhm') returns (0.0033, R)
+    The parsed values are cached, but the warnings are reported for each call
+    """
+    return report_value(get_parsed_value(component, ref_prefix, get_decimal_point()), component, ref)
+
+
+def comp_match_list(components):
+    """ Computes comp_match() for a list of (value, ref_prefix, ref) tuples.
+        Each distinct value is parsed only once, the warnings are reported for each reference.
+        Returns a list of (comp_match() result, warning code or None) tuples """
+    dec_point = get_decimal_point()
+    parsed = {}
+    res = []
+    for component, ref_prefix, ref in components:
+        key = (component, ref_prefix)
+        r = parsed.get(key)
+        if r is None:
+            r = parsed[key] = get_parsed_value(component, ref_prefix, dec_point)
+        res.append((report_value(r, component, ref), r[1]))
+    return res
 
 
 def compare_values(c1, c2):
@@ -74,6 +74,8 @@ KICOST_COLUMNS = {'refs': ColumnList.COL_REFERENCE,
                   'desc': ColumnList.COL_DESCRIPTION,
                   'qty': ColumnList.COL_GRP_BUILD_QUANTITY}
 SPECS_GENERATED = {ColumnList.COL_REFERENCE_L, ColumnList.COL_ROW_NUMBER_L, 'sep'}
+# Use the xlsxwriter `constant_memory` mode for BoMs with more groups
+CONSTANT_MEMORY_THRESHOLD = 2000
 
 
 # Progress bar for KiCost, we just add a filter to the logger
@@ -341,15 +343,33 @@ def adjust_widths(worksheet, column_widths, max_width, levels):
             worksheet.set_column(i, i, width, None, {'level': levels[i]})
 
 
-def adjust_heights(worksheet, rows, max_width, head_size):
-    for rn, r in enumerate(rows):
-        max_h = 1
-        for c in r:
-            if len(c) > max_width:
-                h = len(wrap(c, max_width))
-                max_h = max(h, max_h)
-        if max_h > 1:
-            worksheet.set_row(head_size+rn, 15.0*max_h)
+def adjust_height(worksheet, row_count, row, max_width):
+    """ Make the row tall enough for the wrapped cells """
+    max_h = 1
+    for c in row:
+        if len(c) > max_width:
+            h = len(wrap(c, max_width))
+            max_h = max(h, max_h)
+    if max_h > 1:
+        worksheet.set_row(row_count, 15.0*max_h)
+
+
+class OrderedWrites(object):
+    """ Records the writes to a worksheet and then applies them in row order.
+        Used for the page head, which isn't filled in order, when using the `constant_memory` mode """
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.ops = []
+
+    def __getattr__(self, name):
+        # write_string, write_number, merge_range, set_row, etc.
+        def record(row, *args):
+            self.ops.append((row, len(self.ops), name, args))
+        return record
+
+    def flush(self):
+        for row, _, name, args in sorted(self.ops):
+            getattr(self.worksheet, name)(row, *args)
 
 
 def write_info(cfg, r_info_start, worksheet, column_widths, col1, fmt_info, fmt_subtitle, compact=False):
@@ -639,11 +659,12 @@ def _create_kicost_sheet(workbook, groups, image_data, fmt_title, fmt_info, fmt_
                 continue
             part = PartGroup()
             part.refs = [c.ref for c in g.components]
-            part.fields = g.fields
+            # A copy, the groups are shared with other BoMs using the same options
+            part.fields = dict(g.fields)
             part.fields['manf#_qty'] = compute_qtys(cfg, g)
             parts.append(part)
             # Process any "join" request
-            apply_join_requests(cfg.join_ce, part.fields, g.fields)
+            apply_join_requests(cfg.join_ce, part.fields, part.fields)
         # Fill the quantity members of the parts
         solve_parts_qtys(parts, multi_prj, prj_info)
         # Distributors
@@ -719,7 +740,12 @@ def write_xlsx(filename, groups, col_fields, head_names, cfg):
     link_digikey = cfg.xlsx.digikey_link
     hl_empty = cfg.xlsx.highlight_empty
 
-    workbook = Workbook(filename)
+    # For big BoMs flush each row to disk as soon as we finish it.
+    # Not for KiCost, it doesn't fill the rows in order.
+    constant_memory = len(groups) > CONSTANT_MEMORY_THRESHOLD and not cfg.xlsx.kicost
+    if constant_memory:
+        logger.debug('Using the XLSX constant memory mode')
+    workbook = Workbook(filename, {'constant_memory': constant_memory})
     ws_names = ['BoM', 'DNF']
     row_headings = head_names
 
@@ -750,6 +776,7 @@ def write_xlsx(filename, groups, col_fields, head_names, cfg):
     # #######################
     # Fill the cells
     # #######################
+    # Note: we fill the rows in order, needed for the `constant_memory` mode
     # Normal BoM & DNF
     for ws in range(2):
         # Second pass is DNF
@@ -760,17 +787,29 @@ def write_xlsx(filename, groups, col_fields, head_names, cfg):
 
         worksheet = workbook.add_worksheet(ws_names[ws])
         row_count = head_size
+        column_widths = [0]*max(len(col_fields), 6)
+        for i in range(len(row_headings)):
+            column_widths[i] = len(row_headings[i]) + 10
+
+        # Page head
+        # Logo
+        col1 = insert_logo(worksheet, image_data, cfg.xlsx.logo_scale)
+        head = OrderedWrites(worksheet)
+        # Title
+        do_title(cfg, head, col1, len(column_widths)-1, fmt_title, fmt_info[0] if fmt_info else None)
+        # PCB & Stats Info
+        if not (cfg.xlsx.hide_pcb_info and cfg.xlsx.hide_stats_info):
+            write_info(cfg, r_info_start, head, column_widths, col1, fmt_info, fmt_subtitle)
+        head.flush()
 
         # Headings
         # Create the head titles
-        column_widths = [0]*max(len(col_fields), 6)
-        rows = [row_headings]
         for i in range(len(row_headings)):
             # Title for this column
-            column_widths[i] = len(row_headings[i]) + 10
             worksheet.write_string(row_count, i, row_headings[i], fmt_head)
             if cfg.column_comments[i]:
                 worksheet.write_comment(row_count, i, cfg.column_comments[i])
+        adjust_height(worksheet, row_count, row_headings, max_width)
 
         # Body
         row_count += 1
@@ -779,7 +818,6 @@ def write_xlsx(filename, groups, col_fields, head_names, cfg):
                 continue
             # Get the data row
             row = group.get_row(col_fields)
-            rows.append(row)
             if link_datasheet != -1:
                 datasheet = group.get_field(ColumnList.COL_DATASHEET_L)
             # Fill the row
@@ -800,20 +838,11 @@ def write_xlsx(filename, groups, col_fields, head_names, cfg):
                     worksheet.write_string(row_count, i, cell, fmt)
                 if len(cell) > column_widths[i] - 5:
                     column_widths[i] = len(cell) + 5
+            adjust_height(worksheet, row_count, row, max_width)
             row_count += 1
 
-        # Page head
-        # Logo
-        col1 = insert_logo(worksheet, image_data, cfg.xlsx.logo_scale)
-        # Title
-        do_title(cfg, worksheet, col1, len(column_widths)-1, fmt_title, fmt_info[0] if fmt_info else None)
-        # PCB & Stats Info
-        if not (cfg.xlsx.hide_pcb_info and cfg.xlsx.hide_stats_info):
-            write_info(cfg, r_info_start, worksheet, column_widths, col1, fmt_info, fmt_subtitle)
-
-        # Adjust cols and rows
+        # Adjust cols
         adjust_widths(worksheet, column_widths, max_width, cfg.column_levels)
-        adjust_heights(worksheet, rows, max_width, head_size)
 
         worksheet.freeze_panes(head_size+1, 0)
         worksheet.repeat_rows(head_size+1)
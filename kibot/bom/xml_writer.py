@@ -9,8 +9,16 @@
 """
 XML Writer: Generates an XML BoM file.
 """
-from xml.etree import ElementTree
-from xml.dom import minidom
+from .csv_writer import get_rows
+
+
+def xml_attrs(attrib):
+    """ Attributes in the same format used by minidom """
+    res = ''
+    for name, value in attrib.items():
+        value = value.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+        res += ' {}="{}"'.format(name, value)
+    return res
 
 
 def write_xml(filename, groups, headings, head_names, cfg):
@@ -46,25 +54,26 @@ def write_xml(filename, groups, headings, head_names, cfg):
             attrib['Fitted_Components{}'.format(n)] = str(prj.fitted_str)
             attrib['Number_of_PCBs{}'.format(n)] = str(prj.number)
             attrib['Total_Components{}'.format(n)] = str(prj.comp_build)
-    xml = ElementTree.Element('KiCad_BOM', attrib=attrib, encoding='utf-8')
-    for group in groups:
-        if cfg.ignore_dnf and not group.is_fitted():
-            continue
-        row = group.get_row(headings)
-        attrib = {}
-        for i, h in enumerate(head_names):
-            # Adapt the column name to a valid XML attribute name
-            h = h.replace(' ', '_')
-            h = h.replace('"', '')
-            h = h.replace("'", '')
-            h = h.replace('#', '_num')
-            attrib[h] = str(row[i])
-        ElementTree.SubElement(xml, "group", attrib=attrib)
-
+    attrib['encoding'] = 'utf-8'
+    # Adapt the column names to valid XML attribute names
+    names = []
+    for h in head_names:
+        h = h.replace(' ', '_')
+        h = h.replace('"', '')
+        h = h.replace("'", '')
+        h = h.replace('#', '_num')
+        names.append(h)
     # Most of the UTF-8 enforcement here is for Windows
-    # Selecting it in the tostring  call is enough for Linux
+    # The rows are written as soon as we get them, no need to keep the whole document in memory
     with open(filename, "wt", encoding="utf-8") as output:
-        out = ElementTree.tostring(xml, encoding="utf-8")
-        output.write(minidom.parseString(out).toprettyxml(indent="\t", encoding="utf-8").decode("utf-8"))
+        output.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        output.write('<KiCad_BOM'+xml_attrs(attrib))
+        empty = True
+        for row in get_rows(groups, headings, cfg):
+            if empty:
+                output.write('>\n')
+                empty = False
+            output.write('\t<group'+xml_attrs({h: str(row[i]) for i, h in enumerate(names)})+'/>\n')
+        output.write('/>\n' if empty else '</KiCad_BOM>\n')
 
     return True
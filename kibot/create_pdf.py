@@ -5,39 +5,188 @@
 # License: GPL-3.0
 # Project: KiBot (formerly KiPlot)
 # Base idea: https://gitlab.com/dennevi/Board2Pdf/ (Released as Public Domain)
+import codecs
+from contextlib import ExitStack
+from hashlib import sha1
+from io import BytesIO
+from mmap import mmap, ACCESS_READ
+from os import cpu_count
 from . import PyPDF2
+from .PyPDF2.pdf import compressPagesContentStreams
+from .PyPDF2.generic import (DictionaryObject, ArrayObject, StreamObject, EncodedStreamObject, DecodedStreamObject,
+                             IndirectObject, NameObject, NumberObject, NullObject, createStringObject)
+from .PyPDF2.utils import PdfReadError
 from .error import KiPlotConfigurationError
+# Marks an object that is being translated, used to detect reference loops
+IN_PROGRESS = object()
+
+
+class PdfMerger(object):
+    """ Merges the pages of PDF files writing the objects as soon as they are translated.
+        Only one input file is open at a time.
+        Identical objects (fonts, images, forms, etc.) are stored only once. """
+    PAGES_ID = 1
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.offsets = {}
+        self.next_id = self.PAGES_ID+1
+        # Hash of the already written objects -> id
+        self.written = {}
+        self.kids = ArrayObject()
+        self.pages_ref = IndirectObject(self.PAGES_ID, 0, None)
+        stream.write(b'%PDF-1.3\n')
+
+    def new_id(self):
+        id = self.next_id
+        self.next_id += 1
+        return id
+
+    def write_object(self, id, data):
+        self.offsets[id] = self.stream.tell()
+        self.stream.write(b'%d 0 obj\n' % id)
+        self.stream.write(data)
+        self.stream.write(b'\nendobj\n')
+
+    @staticmethod
+    def serialize(obj):
+        data = BytesIO()
+        obj.writeToStream(data, None)
+        return data.getvalue()
+
+    def add_object(self, obj, id=None):
+        """ Writes an object, objects already written are reused.
+            If `id` is provided the object is written using this id and isn't shared """
+        data = self.serialize(obj)
+        if id is None:
+            digest = sha1(data).digest()
+            id = self.written.get(digest)
+            if id is not None:
+                return id
+            id = self.new_id()
+            self.written[digest] = id
+        self.write_object(id, data)
+        return id
+
+    def translate_ref(self, ref):
+        """ Translates an indirect reference from the current input file """
+        key = (ref.idnum, ref.generation)
+        id = self.refs.get(key)
+        if id is IN_PROGRESS:
+            # Reference loop, we need the id now, so this object isn't shared
+            id = self.refs[key] = self.new_id()
+        if id is not None:
+            return IndirectObject(id, 0, None)
+        obj = self.reader.getObject(ref)
+        if isinstance(obj, DictionaryObject) and obj.get('/Type') == '/Pages':
+            # The pages tree is created from scratch
+            return NullObject()
+        self.refs[key] = IN_PROGRESS
+        new_obj = self.translate(obj)
+        id = self.refs[key]
+        self.refs[key] = self.add_object(new_obj, None if id is IN_PROGRESS else id)
+        return IndirectObject(self.refs[key], 0, None)
+
+    def translate_value(self, value):
+        if isinstance(value, IndirectObject):
+            return self.translate_ref(value)
+        if isinstance(value, StreamObject):
+            # Streams must be indirect objects
+            return IndirectObject(self.add_object(self.translate(value)), 0, None)
+        return self.translate(value)
+
+    def translate(self, obj, skip=()):
+        """ Creates a copy of `obj` using references to the output file """
+        if isinstance(obj, DictionaryObject):
+            if isinstance(obj, StreamObject):
+                new_obj = EncodedStreamObject() if '/Filter' in obj else DecodedStreamObject()
+                new_obj._data = obj._data
+                # The length is computed when writing
+                skip += ('/Length',)
+            else:
+                new_obj = DictionaryObject()
+            for k, v in obj.items():
+                if k not in skip:
+                    new_obj[NameObject(k)] = self.translate_value(v)
+            return new_obj
+        if isinstance(obj, ArrayObject):
+            return ArrayObject(self.translate_value(v) for v in obj)
+        # Numbers, names, strings, etc. are immutable for our purposes
+        return obj
+
+    @staticmethod
+    def read_pages(f):
+        """ Returns the reader and the pages for the PDF file `f` """
+        reader = PyPDF2.PdfFileReader(f)
+        return reader, [reader.getPage(n) for n in range(reader.getNumPages())]
+
+    def add_pages(self, reader, pages):
+        """ Adds the `pages` read by `reader` """
+        self.reader = reader
+        # Assign the ids for the pages in advance, annotations, destinations, etc. can refer to them
+        self.refs = {}
+        ids = []
+        for page in pages:
+            id = self.new_id()
+            ids.append(id)
+            if page.indirectRef is not None:
+                self.refs[(page.indirectRef.idnum, page.indirectRef.generation)] = id
+        for page, id in zip(pages, ids):
+            new_page = self.translate(page, skip=('/Parent',))
+            new_page[NameObject('/Parent')] = self.pages_ref
+            self.add_object(new_page, id)
+            self.kids.append(IndirectObject(id, 0, None))
+        self.reader = self.refs = None
+
+    def close(self):
+        """ Writes the pages tree, the catalog, the information and the cross-reference table """
+        pages = DictionaryObject({NameObject('/Type'): NameObject('/Pages'),
+                                  NameObject('/Kids'): self.kids,
+                                  NameObject('/Count'): NumberObject(len(self.kids))})
+        self.add_object(pages, self.PAGES_ID)
+        catalog = DictionaryObject({NameObject('/Type'): NameObject('/Catalog'), NameObject('/Pages'): self.pages_ref})
+        root = self.add_object(catalog, self.new_id())
+        producer = createStringObject(codecs.BOM_UTF16_BE + 'PyPDF2'.encode('utf-16be'))
+        info = self.add_object(DictionaryObject({NameObject('/Producer'): producer}), self.new_id())
+        # xref table
+        xref = self.stream.tell()
+        size = self.next_id
+        self.stream.write(b'xref\n0 %d\n%010d %05d f \n' % (size, 0, 65535))
+        self.stream.write(b''.join(b'%010d %05d n \n' % (self.offsets[id], 0) for id in range(1, size)))
+        # trailer
+        self.stream.write(b'trailer\n')
+        trailer = DictionaryObject({NameObject('/Size'): NumberObject(size),
+                                    NameObject('/Root'): IndirectObject(root, 0, None),
+                                    NameObject('/Info'): IndirectObject(info, 0, None)})
+        self.stream.write(self.serialize(trailer))
+        self.stream.write(b'\nstartxref\n%d\n%%%%EOF\n' % xref)
 
 
 def create_pdf_from_pages(input_files, output_fn):
-    output = PyPDF2.PdfFileWriter()
-    # Collect all pages
-    open_files = []
-    er = None
-    for filename in input_files:
-        try:
-            file = open(filename, 'rb')
-            open_files.append(file)
-            pdf_reader = PyPDF2.PdfFileReader(file)
-            page_obj = pdf_reader.getPage(0)
-            page_obj.compressContentStreams()
-            output.addPage(page_obj)
-        except (IOError, ValueError, EOFError) as e:
-            er = str(e)
-        if er:
-            raise KiPlotConfigurationError('Error reading `{}` ({})'.format(filename, er))
-    # Write all pages to a file
-    pdf_output = None
+    """ Creates `output_fn` containing all the pages from `input_files` """
     try:
         pdf_output = open(output_fn, 'wb')
-        output.write(pdf_output)
-    except (IOError, ValueError, EOFError) as e:
-        er = str(e)
-    finally:
-        if pdf_output:
-            pdf_output.close()
-    if er:
-        raise KiPlotConfigurationError('Error creating `{}` ({})'.format(output_fn, er))
-    # Close the files
-    for f in open_files:
-        f.close()
+    except IOError as e:
+        raise KiPlotConfigurationError('Error creating `{}` ({})'.format(output_fn, str(e)))
+    with pdf_output:
+        merger = PdfMerger(pdf_output)
+        # Only `batch` files are open at a time, their content streams are compressed in parallel
+        batch = cpu_count() or 1
+        for n in range(0, len(input_files), batch):
+            with ExitStack() as stack:
+                inputs = []
+                try:
+                    for filename in input_files[n:n+batch]:
+                        f = stack.enter_context(open(filename, 'rb'))
+                        # Map the file, the reader does a lot of small seeks and reads
+                        inputs.append(merger.read_pages(stack.enter_context(mmap(f.fileno(), 0, access=ACCESS_READ))))
+                    filename = ', '.join(input_files[n:n+batch])
+                    compressPagesContentStreams([page for _, pages in inputs for page in pages], batch)
+                    for filename, (reader, pages) in zip(input_files[n:n+batch], inputs):
+                        merger.add_pages(reader, pages)
+                except (IOError, ValueError, EOFError, IndexError, PdfReadError) as e:
+                    raise KiPlotConfigurationError('Error reading `{}` ({})'.format(filename, str(e)))
+        try:
+            merger.close()
+        except (IOError, ValueError, EOFError) as e:
+            raise KiPlotConfigurationError('Error creating `{}` ({})'.format(output_fn, str(e)))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2022 Salvador E. Tropea
+# Copyright (c) 2022 Instituto Nacional de Tecnología Industrial
+# License: GPL-3.0
+# Project: KiBot (formerly KiPlot)
+"""
+Pool of virtual X servers (Xvfb) shared by the KiAuto tools.
+The servers are started once, by the main process, and used by any process (see kiplot.run_outputs).
+A lock file for each display ensures only one tool uses it at a time.
+"""
+import os
+from atexit import register as atexit_register
+from contextlib import contextmanager
+from fcntl import flock, LOCK_EX, LOCK_NB, LOCK_UN
+from select import select
+from shutil import rmtree
+from subprocess import Popen, DEVNULL
+from tempfile import mkdtemp
+from time import time
+from .misc import W_NODISPLAY
+from . import log
+
+logger = log.get_logger()
+# Time to wait for a server to be ready
+START_TIME_OUT = 10
+SCREEN = '1440x900x24'
+
+
+class Display(object):
+    """ One Xvfb server """
+    def __init__(self, index, lock_file):
+        self.index = index
+        self.lock_file = lock_file
+        self.proc = None
+        self.number = None
+
+    @property
+    def name(self):
+        return ':{}'.format(self.number)
+
+    def start(self, command):
+        """ Starts the server, the server chooses a free display number and reports it using a pipe """
+        r, w = os.pipe()
+        try:
+            self.proc = Popen([command, '-displayfd', str(w), '-screen', '0', SCREEN, '-nolisten', 'tcp'],
+                              pass_fds=(w,), stdin=DEVNULL, stdout=DEVNULL, stderr=DEVNULL)
+        except OSError as e:
+            os.close(r)
+            os.close(w)
+            logger.warning(W_NODISPLAY+'Unable to start `{}` ({})'.format(command, e))
+            return False
+        os.close(w)
+        data = b''
+        end = time()+START_TIME_OUT
+        with os.fdopen(r, 'rb') as f:
+            while not data.endswith(b'\n') and time() < end:
+                if not select([f], [], [], end-time())[0]:
+                    break
+                chunk = os.read(f.fileno(), 32)
+                if not chunk:
+                    break
+                data += chunk
+        try:
+            self.number = int(data)
+        except ValueError:
+            logger.warning(W_NODISPLAY+'`{}` failed to start'.format(command))
+            self.stop()
+            return False
+        logger.debug('Started virtual display {} (pid {})'.format(self.name, self.proc.pid))
+        return True
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(5)
+            except Exception:
+                self.proc.kill()
+        self.proc = None
+        self.number = None
+
+    def is_alive(self, owner):
+        """ Health check. Processes other than the `owner` can't wait for the server, so they send a null signal """
+        if self.proc is None:
+            return False
+        if os.getpid() == owner:
+            if self.proc.poll() is not None:
+                return False
+        else:
+            try:
+                os.kill(self.proc.pid, 0)
+            except OSError:
+                return False
+        # The server removes its socket when it finishes
+        return os.path.exists('/tmp/.X11-unix/X{}'.format(self.number))
+
+
+class DisplayPool(object):
+    """ A pool of `size` virtual displays, started using `command` """
+    def __init__(self, size, command='Xvfb'):
+        self.command = command
+        self.owner = os.getpid()
+        self.lock_dir = mkdtemp(prefix='tmp-kibot-displays-')
+        self.displays = [Display(n, os.path.join(self.lock_dir, 'display{}.lock'.format(n))) for n in range(size)]
+        atexit_register(self.close)
+        for d in self.displays:
+            if not d.start(command):
+                # No point in trying again
+                break
+
+    def healthy(self):
+        """ Returns the displays that are running. The owner restarts the dead ones """
+        res = []
+        for d in self.displays:
+            if d.is_alive(self.owner):
+                res.append(d)
+            elif os.getpid() == self.owner and d.number is not None:
+                logger.debug('Virtual display {} is dead, restarting it'.format(d.name))
+                d.stop()
+                if d.start(self.command):
+                    res.append(d)
+        return res
+
+    @contextmanager
+    def environment(self):
+        """ Returns a copy of the environment using a free display, None if the pool is unusable.
+            Waits if all the displays are in use """
+        displays = self.healthy()
+        if not displays:
+            yield None
+            return
+        for d in displays:
+            f = open(d.lock_file, 'w')
+            try:
+                flock(f, LOCK_EX | LOCK_NB)
+                break
+            except BlockingIOError:
+                f.close()
+        else:
+            d = displays[os.getpid() % len(displays)]
+            f = open(d.lock_file, 'w')
+            flock(f, LOCK_EX)
+        try:
+            logger.debug('Using virtual display '+d.name)
+            yield dict(os.environ, DISPLAY=d.name)
+        finally:
+            flock(f, LOCK_UN)
+            f.close()
+
+    def close(self):
+        # Forked processes inherit the atexit handler, the servers belong to the owner
+        if os.getpid() != self.owner:
+            return
+        for d in self.displays:
+            d.stop()
+        rmtree(self.lock_dir, ignore_errors=True)
@@ -3,6 +3,7 @@
 # Copyright (c) 2020-2021 Instituto Nacional de Tecnología Industrial
 # License: GPL-3.0
 # Project: KiBot (formerly KiPlot)
+from time import perf_counter
 from .registrable import RegFilter, Registrable, RegOutput
 from .optionable import Optionable
 from .gs import GS
@@ -14,6 +15,10 @@ from .macros import macros, document  # noqa: F401
 from . import log
 
 logger = log.get_logger()
+# Results of the filters and variants, see apply_filters
+filters_cache = {}
+# A transform filter changed the fields after the last reset_filters
+fields_changed = False
 DEFAULT_EXCLUDE = [{'column': ColumnList.COL_REFERENCE, 'regex': '^TP[0-9]*'},
                    {'column': ColumnList.COL_REFERENCE, 'regex': '^FID'},
                    {'column': ColumnList.COL_PART, 'regex': '^mount.*hole'},
@@ -73,6 +78,52 @@ class DummyFilter(Registrable):
     def filter(self, comp):
         return True
 
+    def filter_table(self, table):
+        return [True]*len(table.comps)
+
+
+class ComponentTable(object):
+    """ Columnar view of a list of components.
+        Used to apply the logic filters to all the components at once.
+        The columns are extracted on demand and the tests are computed only once for each different value. """
+    def __init__(self, comps):
+        self.comps = comps
+        self._columns = {}
+
+    def values(self, kind, name):
+        """ Column for the `name` attribute (kind='attr') or field (kind='field') """
+        key = (kind, name)
+        column = self._columns.get(key)
+        if column is None:
+            if kind == 'attr':
+                column = [getattr(c, name) for c in self.comps]
+            else:
+                column = [c.get_field_value(name) for c in self.comps]
+            self._columns[key] = column
+        return column
+
+    def subset(self, indices):
+        """ A table containing only the components at `indices`, keeps the already extracted columns """
+        table = ComponentTable([self.comps[i] for i in indices])
+        table._columns = {k: [v[i] for i in indices] for k, v in self._columns.items()}
+        return table
+
+    @staticmethod
+    def map(values, test):
+        """ Applies `test` to the values, only once for each different value """
+        results = {v: test(v) for v in set(values)}
+        return [results[v] for v in values]
+
+
+def filter_table(filter, table):
+    """ Applies a logic filter to a ComponentTable, collecting profiling data when enabled """
+    if not GS.global_profile_filters:
+        return filter.filter_table(table)
+    start = perf_counter()
+    res = filter.filter_table(table)
+    log.add_filter_stats('filter', filter.name, len(res), sum(1 for ok in res if ok), perf_counter()-start)
+    return res
+
 
 class MultiFilter(Registrable):
     """ A filter containing a list of filters.
@@ -84,8 +135,13 @@ class MultiFilter(Registrable):
         self.comment = 'Multi-filter'
         self.filters = filters
         self._is_transform = is_transform
+        # Only logic filters, used for logic
+        self._logic_only = not is_transform and not any(f._is_transform for f in filters)
 
     def filter(self, comp):
+        if self._logic_only:
+            # No need to create lists
+            return all(f.filter(comp) for f in self.filters)
         comps = [comp]
         # We support logic and transform filters mixed
         # Apply all the filters
@@ -120,6 +176,23 @@ class MultiFilter(Registrable):
             return None
         return comps
 
+    def filter_table(self, table):
+        if not self._logic_only:
+            return [self.filter(c) for c in table.comps]
+        res = [False]*len(table.comps)
+        indices = list(range(len(table.comps)))
+        for f in self.filters:
+            # Only the components that passed the previous filters are tested
+            passed = filter_table(f, table)
+            if not all(passed):
+                indices = [i for i, ok in zip(indices, passed) if ok]
+                if not indices:
+                    return res
+                table = table.subset([i for i, ok in enumerate(passed) if ok])
+        for i in indices:
+            res[i] = True
+        return res
+
 
 class NotFilter(Registrable):
     """ A filter that returns the inverted result """
@@ -134,17 +207,28 @@ class NotFilter(Registrable):
     def filter(self, comp):
         return not self._filter.filter(comp)
 
+    def filter_table(self, table):
+        return [not ok for ok in filter_table(self._filter, table)]
+
 
 def apply_pre_transform(comps, filter):
+    global fields_changed
     if filter:
+        fields_changed = True
         logger.debug('Applying transform filter `{}`'.format(filter.name))
+        start = perf_counter()
         new_comps = []
+        unchanged = 0
         for c in comps:
             ret = filter.filter(c)
             if ret is None:
                 new_comps.append(c)
+                unchanged += 1
             else:
                 new_comps.extend(ret)
+        if GS.global_profile_filters:
+            # For transform filters the accepted components are the ones that weren't replaced
+            log.add_filter_stats('transform', filter.name, len(comps), unchanged, perf_counter()-start)
         return new_comps
     return comps
 
@@ -152,36 +236,101 @@ def apply_pre_transform(comps, filter):
 def apply_exclude_filter(comps, filter):
     if filter:
         logger.debug('Applying filter `{}` to exclude'.format(filter.name))
-        for c in comps:
-            if c.included:
-                c.included = filter.filter(c)
+        table = ComponentTable([c for c in comps if c.included])
+        for c, included in zip(table.comps, filter_table(filter, table)):
+            c.included = included
 
 
 def reset_filters(comps):
+    global fields_changed
     logger.debug('Filters reset')
     for c in comps:
         c.included = True
         c.fitted = True
         c.fixed = False
         c.back_up_fields()
+    fields_changed = False
 
 
 def apply_fitted_filter(comps, filter):
     if filter:
         logger.debug('Applying filter `{}` to fitted'.format(filter.name))
-        for c in comps:
-            if c.fitted:
-                c.fitted = filter.filter(c)
-                if not c.fitted and GS.debug_level > 2:
-                    logger.debug('- Not fit: '+c.ref)
+        table = ComponentTable([c for c in comps if c.fitted])
+        for c, fitted in zip(table.comps, filter_table(filter, table)):
+            c.fitted = fitted
+            if not fitted and GS.debug_level > 2:
+                logger.debug('- Not fit: '+c.ref)
 
 
 def apply_fixed_filter(comps, filter):
     if filter:
         logger.debug('Applying filter `{}` to fixed'.format(filter.name))
-        for c in comps:
-            if not c.fixed:
-                c.fixed = filter.filter(c)
+        table = ComponentTable([c for c in comps if not c.fixed])
+        for c, fixed in zip(table.comps, filter_table(filter, table)):
+            c.fixed = fixed
+
+
+def has_transforms(filter):
+    """ True if the filter can change the components """
+    if filter is None:
+        return False
+    if filter._is_transform:
+        return True
+    if isinstance(filter, MultiFilter):
+        return any(has_transforms(f) for f in filter.filters)
+    return False
+
+
+def apply_filters(comps, variant, exclude_filter=None, dnf_filter=None, dnc_filter=None):
+    """ Resets the filters, applies the exclude, DNF and DNC filters and then the variant.
+        When no transform filter is involved the resulting flags are cached. So other outputs using the same
+        filters and variant just restore them. """
+    key = (variant, exclude_filter, dnf_filter, dnc_filter)
+    cacheable = not (has_transforms(exclude_filter) or has_transforms(dnf_filter) or has_transforms(dnc_filter) or
+                     (variant is not None and (variant.pre_transform or has_transforms(variant.exclude_filter) or
+                      has_transforms(variant.dnf_filter) or has_transforms(variant.dnc_filter))))
+    if cacheable:
+        cached = filters_cache.get(key)
+        if (cached is not None and cached.pcb is GS.pcb and len(cached.comps) == len(comps) and
+           all(a is b and a.ref == ref for a, b, ref in zip(comps, cached.comps, cached.refs))):
+            logger.debug('Using cached filters and variant results')
+            if fields_changed:
+                # Restore the fields
+                reset_filters(comps)
+            for c, flags in zip(comps, cached.flags):
+                c.included = bool(flags & 1)
+                c.fitted = bool(flags & 2)
+                c.fixed = bool(flags & 4)
+            if variant is not None:
+                # The variants also select the variant used by the rename filters
+                GS.variant = cached.variant
+            return comps
+    reset_filters(comps)
+    apply_exclude_filter(comps, exclude_filter)
+    apply_fitted_filter(comps, dnf_filter)
+    apply_fixed_filter(comps, dnc_filter)
+    if variant is not None:
+        start = perf_counter()
+        evaluated = len(comps)
+        comps = variant.filter(comps)
+        if GS.global_profile_filters:
+            log.add_filter_stats('variant', variant.name, evaluated, sum(1 for c in comps if c.fitted and c.included),
+                                 perf_counter()-start)
+    if cacheable:
+        cached = FiltersResult()
+        cached.comps = comps
+        cached.refs = [c.ref for c in comps]
+        cached.pcb = GS.pcb
+        cached.variant = GS.variant
+        # One byte for each component: included, fitted and fixed bits
+        cached.flags = bytes((1 if c.included else 0) | (2 if c.fitted else 0) | (4 if c.fixed else 0) for c in comps)
+        filters_cache[key] = cached
+    return comps
+
+
+class FiltersResult(object):
+    """ Flags computed by apply_filters """
+    pass
 
 
 class BaseFilter(RegFilter):
@@ -208,6 +357,10 @@ class BaseFilter(RegFilter):
         if self.name[0] == '_' and not self._internal:
             raise KiPlotConfigurationError('Filter names starting with `_` are reserved ({})'.format(self.name))
 
+    def filter_table(self, table):
+        """ Applies the filter to all the components in a ComponentTable, returns a list with the results """
+        return [self.filter(c) for c in table.comps]
+
     @staticmethod
     def _create_mechanical(name):
         o_tree = {'name': name}
@@ -6,7 +6,8 @@
 """
 Implements the KiBoM and IBoM filters.
 """
-from re import compile, IGNORECASE
+from operator import attrgetter
+from re import compile, IGNORECASE, error
 from .optionable import Optionable
 from .bom.columnlist import ColumnList
 from .gs import GS
@@ -114,104 +115,158 @@ class Generic(BaseFilter):  # noqa: F821
         # exclude_refs
         if isinstance(self.exclude_refs, type):
             self.exclude_refs = None
+        self._checks = self._compile_checks()
 
-    def test_reg_include(self, c):
-        """ Reject components that doesn't match the provided regex.
-            So we include only the components that matches any of the regexs. """
-        if not self.include_only:  # Nothing to match against, means include all
-            return True
-        for reg in self.include_only:
-            if reg.skip_if_no_field and not c.is_field(reg.column):
-                # Skip the check if the field doesn't exist
-                continue
-            if reg.match_if_field and c.is_field(reg.column):
-                return True
-            if reg.match_if_no_field and not c.is_field(reg.column):
-                return True
-            field_value = c.get_field_value(reg.column)
-            res = reg.regex.search(field_value)
-            if reg.invert:
-                res = not res
-            if res:
-                if GS.debug_level > 1:
-                    logger.debug("Including '{ref}': Field '{field}' ({value}) matched '{re}'".format(
-                                 ref=c.ref, field=reg.column, value=field_value, re=reg.regex))
-                # Found a match
-                return True
-        # Default, could not find a match
-        return False
+    @staticmethod
+    def _compile_reg(reg, action):
+        """ Creates a function to apply one regex, with all its options """
+        column = reg.column
+        regex = reg.regex
+        skip_if_no_field = reg.skip_if_no_field
+        match_if_field = reg.match_if_field
+        match_if_no_field = reg.match_if_no_field
+        invert = reg.invert
+        debug = GS.debug_level > 1
 
-    def test_reg_exclude(self, c):
-        """ Test if this part should be included, based on any regex expressions provided in the preferences """
-        if not self.exclude_any:  # Nothing to match against, means don't exclude any
-            return False
-        for reg in self.exclude_any:
-            if reg.skip_if_no_field and not c.is_field(reg.column):
+        def test(c):
+            has_field = c.is_field(column)
+            if skip_if_no_field and not has_field:
                 # Skip the check if the field doesn't exist
-                continue
-            if reg.match_if_field and c.is_field(reg.column):
+                return False
+            if match_if_field and has_field:
                 return True
-            if reg.match_if_no_field and not c.is_field(reg.column):
+            if match_if_no_field and not has_field:
                 return True
-            field_value = c.get_field_value(reg.column)
-            res = reg.regex.search(field_value)
-            if reg.invert:
+            field_value = c.get_field_value(column)
+            res = regex.search(field_value)
+            if invert:
                 res = not res
-            if res:
-                if GS.debug_level > 1:
-                    logger.debug("Excluding '{ref}': Field '{field}' ({value}) matched '{re}'".format(
-                                 ref=c.ref, field=reg.column, value=field_value, re=reg.regex))
-                # Found a match
-                return True
-        # Default, could not find any matches
-        return False
+            if res and debug:
+                logger.debug("{action} '{ref}': Field '{field}' ({value}) matched '{re}'".format(
+                             action=action, ref=c.ref, field=column, value=field_value, re=regex))
+            return bool(res)
+        return test
 
-    def filter(self, comp):
-        exclude = self.invert
-        value = comp.value.strip().lower()
+    @staticmethod
+    def _check(kind, name, test):
+        """ A check applied to an attribute (kind='attr'), a field (kind='field') or the component (kind=None).
+            The `test` returns True when the component fails the check """
+        if kind == 'attr':
+            get = attrgetter(name)
+        elif kind == 'field':
+            def get(c):
+                return c.get_field_value(name)
+        else:
+            def get(c):
+                return c
+        return (kind, name, get, test)
+
+    @staticmethod
+    def _compile_regs(regs, action):
+        """ Creates a list of checks, the component matches if ANY of them is True.
+            When possible the regexs for the same column are merged into one alternation """
+        if not regs:
+            return []
+        # Simple regexs, grouped by column
+        simple = {}
+        others = []
+        for reg in regs:
+            if (reg.skip_if_no_field or reg.match_if_field or reg.match_if_no_field or reg.invert or reg.regex.groups or
+               GS.debug_level > 1):
+                # Special options, groups that can be referenced or the user wants to know which regex matched
+                others.append(reg)
+            else:
+                simple.setdefault(reg.column, []).append(reg)
+        checks = []
+        for column, col_regs in simple.items():
+            if len(col_regs) == 1:
+                regex = col_regs[0].regex
+            else:
+                try:
+                    regex = compile('|'.join('(?:'+r.regex.pattern+')' for r in col_regs), flags=IGNORECASE)
+                except error:
+                    # I.e. global flags in the middle
+                    others.extend(col_regs)
+                    continue
+            checks.append(Generic._check('field', column, lambda v, regex=regex: regex.search(v) is not None))
+        checks.extend(Generic._check(None, None, Generic._compile_reg(reg, action)) for reg in others)
+        return checks
+
+    def _compile_checks(self):
+        """ Creates a list of checks, one for each enabled test.
+            They can be applied to one component or to a whole column (see filter_table) """
+        checks = []
         # Exclude components with empty 'Value'
-        if self.exclude_empty_val and (value == '' or value == '~'):
-            return exclude
+        if self.exclude_empty_val:
+            checks.append(self._check('attr', 'value', lambda v: v.strip() in ('', '~')))
         # Exclude all ref == #*
-        if self.exclude_all_hash_ref and comp.ref[0] == '#':
-            return exclude
+        if self.exclude_all_hash_ref:
+            checks.append(self._check('attr', 'ref', lambda v: v[0] == '#'))
         # KiCad 5 PCB classification
-        if self.exclude_virtual and comp.virtual:
-            return exclude
-        if self.exclude_smd and comp.smd:
-            return exclude
-        if self.exclude_tht and comp.tht:
-            return exclude
+        if self.exclude_virtual:
+            checks.append(self._check('attr', 'virtual', bool))
+        if self.exclude_smd:
+            checks.append(self._check('attr', 'smd', bool))
+        if self.exclude_tht:
+            checks.append(self._check('attr', 'tht', bool))
         # List of references to be excluded
-        if self.exclude_refs and (comp.ref in self.exclude_refs or comp.ref_prefix+'*' in self.exclude_refs):
-            return exclude
+        if self.exclude_refs:
+            refs = frozenset(self.exclude_refs)
+            checks.append(self._check('attr', 'ref', lambda v: v in refs))
+            checks.append(self._check('attr', 'ref_prefix', lambda v: v+'*' in refs))
         # All stuff where keys are involved
         if self.keys:
+            keys = frozenset(self.keys)
             # Exclude components if their 'Value' is any of the keys
-            if self.exclude_value and value in self.keys:
-                return exclude
+            if self.exclude_value:
+                checks.append(self._check('attr', 'value', lambda v: v.strip().lower() in keys))
             # Exclude components if a field is named as any of the keys
             if self.exclude_field:
-                for k in self.keys:
-                    if k in comp.dfields:
-                        return exclude
+                checks.append(self._check(None, None, lambda c: not keys.isdisjoint(c.dfields)))
             # Exclude components containing a key value in the config field.
             if self.exclude_config:
-                config = comp.get_field_value(self.config_field).strip().lower()
-                if self.config_separators:
-                    # Try with all the separators
-                    for sep in self.config_separators:
-                        opts = config.split(sep)
-                        # Try with all the extracted values
-                        for opt in opts:
-                            if opt.strip() in self.keys:
-                                return exclude
+                separators = self.config_separators
+                if separators:
+                    def test_config(config):
+                        config = config.strip().lower()
+                        # Try with all the separators and all the extracted values
+                        return any(opt.strip() in keys for sep in separators for opt in config.split(sep))
+                    checks.append(self._check('field', self.config_field, test_config))
                 else:  # No separator
-                    if config in self.keys:
-                        return exclude
+                    checks.append(self._check('field', self.config_field, lambda v: v.strip().lower() in keys))
         # Regular expressions
-        if not self.test_reg_include(comp):
-            return exclude
-        if self.test_reg_exclude(comp):
-            return exclude
-        return not exclude
+        # Reject components that doesn't match the provided regex.
+        # So we include only the components that matches any of the regexs.
+        include = self._compile_regs(self.include_only, 'Including')
+        if len(include) == 1:
+            kind, name, _, test = include[0]
+            checks.append(self._check(kind, name, lambda v: not test(v)))
+        elif include:
+            checks.append(self._check(None, None, lambda c: not any(test(get(c)) for _, _, get, test in include)))
+        # Exclude the components matching any of the regexs
+        checks.extend(self._compile_regs(self.exclude_any, 'Excluding'))
+        return checks
+
+    def filter(self, comp):
+        for _, _, get, test in self._checks:
+            if test(get(comp)):
+                return self.invert
+        return not self.invert
+
+    def filter_table(self, table):
+        """ Applies the checks to whole columns. Each check is computed only for the components that passed the
+            previous checks, and only once for each different value """
+        res = [self.invert]*len(table.comps)
+        pending = list(range(len(table.comps)))
+        for kind, name, _, test in self._checks:
+            if not pending:
+                return res
+            if kind is None:
+                failed = [test(table.comps[i]) for i in pending]
+            else:
+                column = table.values(kind, name)
+                failed = table.map([column[i] for i in pending], test)
+            pending = [i for i, fail in zip(pending, failed) if not fail]
+        for i in pending:
+            res[i] = not self.invert
+        return res
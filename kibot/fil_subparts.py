@@ -9,7 +9,6 @@ The 'manf#' field can contain more than one value separated by ;
 The result is REF#subpart
 """
 import re
-from copy import deepcopy
 from .gs import GS
 from .optionable import Optionable
 from .misc import W_NUMSUBPARTS, W_PARTMULT, DISTRIBUTORS_F
@@ -155,7 +154,7 @@ class Subparts(BaseFilter):  # noqa: F821
             alt_values = self.subpart_list(alt_v)
         alt_values_len = len(alt_values)
         for i in range(max_num_subparts):
-            new_comp = deepcopy(comp)
+            new_comp = comp.shallow_copy()
             if multi_part:
                 # Adjust the reference name
                 if self.use_ref_sep_for_first:
@@ -49,6 +49,11 @@ class Globals(FiltersOptions):
                 For more information consult: https://www.eurocircuits.com/pcb-design-guidelines/drilled-holes/ """
             self.field_3D_model = '_3D_model'
             """ Name for the field controlling the 3D models used for a component """
+            self.kiauto_shared_displays = 0
+            """ Number of virtual X servers (Xvfb) started by KiBot and shared by the KiAuto tools.
+                Use 0 to let each KiAuto call start its own server.
+                The display is passed using the `DISPLAY` environment variable, your KiAuto must be able to use it.
+                A KiAuto that ignores the inherited `DISPLAY` starts its own server, so you won't get any speed-up """
             self.kiauto_time_out_scale = 0.0
             """ Time-out multiplier for KiAuto operations """
             self.kiauto_wait_start = 0
@@ -58,6 +63,9 @@ class Globals(FiltersOptions):
                 KiCad 6: you should set this in the Board Setup -> Physical Stackup """
             self.output = GS.def_global_output
             """ Default pattern for output file names """
+            self.parallel_outputs = False
+            """ Generate the outputs needed by `compress` and `pdfunite` concurrently, using one process for each CPU.
+                The processes are forked after loading the PCB and schematic """
             self.pcb_finish = 'HAL'
             """ Finishing used to protect pads. Currently used for documentation and to choose default colors.
                 KiCad 6: you should set this in the Board Setup -> Board Finish -> Copper Finish option.
@@ -66,6 +74,13 @@ class Globals(FiltersOptions):
             self.pcb_material = 'FR4'
             """ PCB core material. Currently used for documentation and to choose default colors.
                 Currently known are FR1 to FR5 """
+            self.profile_filters = False
+            """ Collect statistics about the filters and variants: evaluated components, accepted, rejected and time.
+                A summary is printed at the end of the run. For transform filters the accepted components are the ones
+                that weren't replaced """
+            self.profile_filters_json = ''
+            """ Also store the filters and variants statistics in this JSON file. Relative to the output dir.
+                Enables `profile_filters` """
             self.silk_screen_color = 'white'
             """ Color for the markings. Currently used for documentation and to choose default colors.
                 KiCad 6: you should set this in the Board Setup -> Physical Stackup.
@@ -231,6 +246,8 @@ class Globals(FiltersOptions):
                 GS.global_silk_screen_color_top = GS.global_silk_screen_color
             if not GS.global_silk_screen_color_bottom:
                 GS.global_silk_screen_color_bottom = GS.global_silk_screen_color
+        if GS.global_profile_filters_json:
+            GS.global_profile_filters = True
         set_filters(self.unparsed)
 
 
@@ -49,6 +49,8 @@ class GS(object):
     out_dir_in_cmd_line = False
     filter_file = None
     board = None
+    # PCB data from our own parser (no pcbnew needed), see load_pcb()
+    pcb = None
     sch = None
     debug_enabled = False
     debug_level = 0
@@ -106,6 +108,7 @@ class GS(object):
     global_edge_plating = None
     global_extra_pth_drill = None
     global_field_3D_model = None
+    global_kiauto_shared_displays = None
     global_kiauto_time_out_scale = None
     global_kiauto_wait_start = None
     global_impedance_controlled = None
@@ -113,8 +116,11 @@ class GS(object):
     #  Classes supporting global "output" option must call super().__init__()
     #  after defining its own options to allow Optionable do the overwrite.
     global_output = None
+    global_parallel_outputs = None
     global_pcb_finish = None
     global_pcb_material = None
+    global_profile_filters = None
+    global_profile_filters_json = None
     global_silk_screen_color = None
     global_silk_screen_color_bottom = None
     global_silk_screen_color_top = None
@@ -223,7 +229,10 @@ class GS(object):
     @staticmethod
     def get_aux_origin():
         if GS.board is None:
-            return (0, 0)
+            if not GS.pcb_file:
+                return (0, 0)
+            # No need to load the board using pcbnew just for this
+            return GS.load_pcb().aux_origin
         if GS.ki6():
             settings = GS.board.GetDesignSettings()
             return settings.GetAuxOrigin()
@@ -235,6 +244,14 @@ class GS(object):
             return m.GetCenter()
         return m.GetPosition()
 
+    @staticmethod
+    def normalize_fp_angle(angle):
+        """ Footprint angle as reported by pcbnew: [0,360) for KiCad 5 and (-180,180] for KiCad 6 """
+        angle = angle % 360
+        if GS.ki6() and angle > 180:
+            angle -= 360
+        return angle
+
     @staticmethod
     def get_fp_size(m):
         if GS.ki5():
@@ -318,15 +335,25 @@ class GS(object):
         GS.pcb_rev = ''
         GS.pcb_comp = ''
         # This is based on InterativeHtmlBom expansion
-        title_block = GS.board.GetTitleBlock()
-        GS.pcb_date = GS.format_date(GS.expand_text_variables(title_block.GetDate()), GS.pcb_file, 'PCB')
-        GS.pcb_title = GS.expand_text_variables(title_block.GetTitle())
+        if GS.board is None:
+            # Avoid loading the board using pcbnew, the file has all we need
+            pcb = GS.load_pcb()
+            title, date, rev, comp, comments = pcb.title, pcb.date, pcb.rev, pcb.company, pcb.comments
+        else:
+            title_block = GS.board.GetTitleBlock()
+            title = title_block.GetTitle()
+            date = title_block.GetDate()
+            rev = title_block.GetRevision()
+            comp = title_block.GetCompany()
+            comments = [GS.get_pcb_comment(title_block, num) for num in range(9)]
+        GS.pcb_date = GS.format_date(GS.expand_text_variables(date), GS.pcb_file, 'PCB')
+        GS.pcb_title = GS.expand_text_variables(title)
         if not GS.pcb_title:
             GS.pcb_title = GS.pcb_basename
-        GS.pcb_rev = GS.expand_text_variables(title_block.GetRevision())
-        GS.pcb_comp = GS.expand_text_variables(title_block.GetCompany())
+        GS.pcb_rev = GS.expand_text_variables(rev)
+        GS.pcb_comp = GS.expand_text_variables(comp)
         for num in range(9):
-            GS.pcb_com[num] = GS.expand_text_variables(GS.get_pcb_comment(title_block, num))
+            GS.pcb_com[num] = GS.expand_text_variables(comments[num])
         logger.debug("PCB title: `{}`".format(GS.pcb_title))
         logger.debug("PCB date: `{}`".format(GS.pcb_date))
         logger.debug("PCB revision: `{}`".format(GS.pcb_rev))
@@ -366,6 +393,11 @@ class GS(object):
         """ Will be repplaced by kiplot.py """
         raise AssertionError()
 
+    @staticmethod
+    def load_pcb():
+        """ Will be repplaced by kiplot.py """
+        raise AssertionError()
+
     @staticmethod
     def get_useful_layers(useful, layers, include_copper=False):
         """ Filters layers selecting the ones from useful """
@@ -5,10 +5,14 @@
 # Project: KiBot (formerly KiPlot)
 """
 KiCad v5/6 PCB format.
-Currently used only for the paper size
+A basic implementation of the .kicad_pcb file format, no pcbnew needed.
+Used for the paper size and by the outputs that only need footprint, pad and track data (no plotting).
+All the coordinates are converted to KiCad internal units (nm), like pcbnew does.
 """
-from .sexpdata import load, SExpData
-from .v6_sch import _check_str, _check_symbol, _check_is_symbol_list, _check_float
+from math import sin, cos, radians
+from .sexpdata import load, SExpData, Symbol
+from .v5_sch import SchError
+from .v6_sch import _check_str, _check_symbol, _check_is_symbol_list, _check_float, _check_integer, _check_relaxed
 PAGE_SIZE = {'A0': (841, 1189),
              'A1': (594, 841),
              'A2': (420, 594),
@@ -23,18 +27,330 @@ PAGE_SIZE = {'A0': (841, 1189),
              'USLetter': (215.9, 279.4),
              'USLegal': (215.9, 355.6),
              'USLedger': (279.4, 431.8)}
+# Same as pcbnew.IU_PER_MM
+IU_PER_MM = 1000000
+# Files older than this are KiCad 5 files (20171130). Here a footprint without attributes is through hole.
+KICAD6_FORMAT = 20200000
 
 
 class PCBError(Exception):
     pass
 
 
+def _to_iu(v):
+    return int(round(v*IU_PER_MM))
+
+
+def _get_xy_iu(items, name):
+    return _to_iu(_check_float(items, 1, name+' x')), _to_iu(_check_float(items, 2, name+' y'))
+
+
+def _get_at_iu(items, name):
+    x, y = _get_xy_iu(items, name)
+    angle = _check_float(items, 3, name+' angle') if len(items) > 3 else 0
+    return x, y, angle
+
+
+def _rotate(x, y, angle):
+    """ Rotates a point the same way KiCad's RotatePoint does (Y axis pointing down) """
+    if not angle:
+        return x, y
+    a = radians(angle)
+    s = sin(a)
+    c = cos(a)
+    return x*c+y*s, y*c-x*s
+
+
+class PCBPad(object):
+    """ A footprint pad. Position is relative to the footprint (not rotated), the angle is absolute """
+    def __init__(self):
+        super().__init__()
+        self.number = ''
+        self.type = ''
+        self.shape = ''
+        self.x = self.y = 0
+        self.angle = 0
+        self.w = self.h = 0
+        self.drill = 0
+        self.layers = []
+
+    @staticmethod
+    def parse(items):
+        name = 'pad'
+        pad = PCBPad()
+        pad.number = _check_relaxed(items, 1, name+' number')
+        pad.type = _check_symbol(items, 2, name+' type')
+        pad.shape = _check_symbol(items, 3, name+' shape')
+        for i in items[4:]:
+            if not isinstance(i, list):
+                # i.e. locked
+                continue
+            i_type = _check_is_symbol_list(i)
+            if i_type == 'at':
+                pad.x, pad.y, pad.angle = _get_at_iu(i, name+' at')
+            elif i_type == 'size':
+                pad.w, pad.h = _get_xy_iu(i, name+' size')
+            elif i_type == 'drill':
+                # (drill D), (drill oval W H) and (drill D (offset X Y))
+                for d in i[1:]:
+                    if isinstance(d, (int, float)):
+                        pad.drill = _to_iu(d)
+                        break
+            elif i_type == 'layers':
+                pad.layers = [_check_relaxed(i, n+1, name+' layers') for n in range(len(i)-1)]
+        return pad
+
+    def bbox_points(self, fp_angle, local):
+        """ Points defining the bounding box of the pad shape, relative to the footprint position.
+            When `local` is True the footprint rotation (`fp_angle`) is removed, otherwise is applied. """
+        if local:
+            x, y = self.x, self.y
+            angle = self.angle-fp_angle
+        else:
+            x, y = _rotate(self.x, self.y, fp_angle)
+            angle = self.angle
+        if self.shape == 'circle':
+            r = self.w/2
+            return [(x-r, y-r), (x+r, y+r)]
+        if self.shape == 'oval':
+            # A segment with round ends
+            if self.w > self.h:
+                r = self.h/2
+                ends = [_rotate(-self.w/2+r, 0, angle), _rotate(self.w/2-r, 0, angle)]
+            else:
+                r = self.w/2
+                ends = [_rotate(0, -self.h/2+r, angle), _rotate(0, self.h/2-r, angle)]
+            return [(x+ex+dx, y+ey+dy) for ex, ey in ends for dx, dy in ((-r, -r), (r, r))]
+        # Rectangles, rounded rectangles, trapezoids and custom anchors
+        dx = self.w/2
+        dy = self.h/2
+        return [(x+cx, y+cy) for cx, cy in (_rotate(p[0], p[1], angle) for p in ((-dx, -dy), (dx, -dy), (dx, dy), (-dx, dy)))]
+
+
+class PCBFootprint(object):
+    def __init__(self):
+        super().__init__()
+        self.lib_id = ''
+        self.name = ''
+        self.ref = ''
+        self.value = ''
+        self.layer = 'F.Cu'
+        self.x = self.y = 0
+        self.angle = 0
+        self.smd = False
+        self.tht = False
+        self.board_only = False
+        self.exclude_from_pos_files = False
+        self.exclude_from_bom = False
+        self.pads = []
+
+    @property
+    def bottom(self):
+        return self.layer == 'B.Cu'
+
+    @property
+    def virtual(self):
+        """ Same as KiCad 5 virtual, KiCad 6 uses both exclude flags """
+        return self.exclude_from_pos_files and self.exclude_from_bom
+
+    @staticmethod
+    def parse(items, version):
+        name = 'footprint'
+        fp = PCBFootprint()
+        fp.lib_id = _check_relaxed(items, 1, name+' lib_id')
+        fp.name = fp.lib_id.split(':', 1)[-1]
+        for i in items[2:]:
+            if not isinstance(i, list):
+                # i.e. locked/placed
+                continue
+            i_type = _check_is_symbol_list(i)
+            if i_type == 'layer':
+                fp.layer = _check_relaxed(i, 1, name+' layer')
+            elif i_type == 'at':
+                fp.x, fp.y, fp.angle = _get_at_iu(i, name+' at')
+            elif i_type == 'attr':
+                for a in i[1:]:
+                    if not isinstance(a, Symbol):
+                        continue
+                    a = a.value()
+                    if a == 'smd':
+                        fp.smd = True
+                    elif a == 'through_hole':
+                        fp.tht = True
+                    elif a == 'board_only':
+                        fp.board_only = True
+                    elif a == 'virtual' or a == 'exclude_from_pos_files':
+                        fp.exclude_from_pos_files = True
+                        if a == 'virtual':
+                            fp.exclude_from_bom = True
+                    elif a == 'exclude_from_bom':
+                        fp.exclude_from_bom = True
+            elif i_type == 'fp_text':
+                t_type = _check_symbol(i, 1, name+' fp_text')
+                if t_type == 'reference':
+                    fp.ref = _check_relaxed(i, 2, name+' reference')
+                elif t_type == 'value':
+                    fp.value = _check_relaxed(i, 2, name+' value')
+            elif i_type == 'pad':
+                fp.pads.append(PCBPad.parse(i))
+        if version < KICAD6_FORMAT and not (fp.smd or fp.exclude_from_pos_files):
+            # KiCad 5: no attribute means through hole
+            fp.tht = True
+        return fp
+
+    def get_pads_size(self, local=True):
+        """ Size of the box containing all the pads.
+            When `local` is True we compute it with 0 rotation, like GetFpPadsLocalBbox (KiCad 6).
+            Otherwise the rotation is applied and the size swapped for vertical footprints (KiCad 5). """
+        if not self.pads:
+            return (0, 0)
+        points = [p for pad in self.pads for p in pad.bbox_points(self.angle, local)]
+        w = int(round(max(p[0] for p in points)-min(p[0] for p in points)))
+        h = int(round(max(p[1] for p in points)-min(p[1] for p in points)))
+        if not local and (self.angle == 270 or self.angle == 90):
+            return (h, w)
+        return (w, h)
+
+
+class PCBTrack(object):
+    """ A track segment or arc """
+    def __init__(self):
+        super().__init__()
+        self.is_arc = False
+        self.start = self.end = self.mid = None
+        self.width = 0
+        self.layer = ''
+        self.net = 0
+
+    @staticmethod
+    def parse(items):
+        name = 'track'
+        track = PCBTrack()
+        track.is_arc = items[0].value() == 'arc'
+        for i in items[1:]:
+            if not isinstance(i, list):
+                continue
+            i_type = _check_is_symbol_list(i)
+            if i_type == 'start':
+                track.start = _get_xy_iu(i, name+' start')
+            elif i_type == 'end':
+                track.end = _get_xy_iu(i, name+' end')
+            elif i_type == 'mid':
+                track.mid = _get_xy_iu(i, name+' mid')
+            elif i_type == 'width':
+                track.width = _to_iu(_check_float(i, 1, name+' width'))
+            elif i_type == 'layer':
+                track.layer = _check_relaxed(i, 1, name+' layer')
+            elif i_type == 'net':
+                track.net = _check_integer(i, 1, name+' net')
+        return track
+
+
+class PCBVia(object):
+    def __init__(self):
+        super().__init__()
+        self.type = 'through'
+        self.x = self.y = 0
+        self.size = 0
+        self.drill = 0
+        self.layers = []
+        self.net = 0
+
+    @staticmethod
+    def parse(items):
+        name = 'via'
+        via = PCBVia()
+        for i in items[1:]:
+            if isinstance(i, Symbol):
+                # blind, micro, locked
+                if i.value() != 'locked':
+                    via.type = i.value()
+                continue
+            i_type = _check_is_symbol_list(i)
+            if i_type == 'at':
+                via.x, via.y = _get_xy_iu(i, name+' at')
+            elif i_type == 'size':
+                via.size = _to_iu(_check_float(i, 1, name+' size'))
+            elif i_type == 'drill':
+                via.drill = _to_iu(_check_float(i, 1, name+' drill'))
+            elif i_type == 'layers':
+                via.layers = [_check_relaxed(i, n+1, name+' layers') for n in range(len(i)-1)]
+            elif i_type == 'net':
+                via.net = _check_integer(i, 1, name+' net')
+        return via
+
+
+class BoardLayer(object):
+    """ A layer declared in the `layers` section """
+    def __init__(self):
+        super().__init__()
+        self.id = 0
+        self.name = ''
+        self.type = ''
+        self.user_name = None
+
+    @staticmethod
+    def parse(items):
+        name = 'layer'
+        la = BoardLayer()
+        la.id = _check_integer(items, 0, name+' id')
+        la.name = _check_relaxed(items, 1, name+' name')
+        la.type = _check_relaxed(items, 2, name+' type')
+        if len(items) > 3:
+            la.user_name = _check_relaxed(items, 3, name+' user name')
+        return la
+
+
 class PCB(object):
     def __init__(self):
         super().__init__()
+        self.version = 0
         self.paper = 'A4'
         self.paper_portrait = False
         self.paper_w = self.paper_h = 0
+        self.title = self.date = self.rev = self.company = ''
+        self.comments = ['']*9
+        self.aux_origin = (0, 0)
+        self.layers = []
+        self.footprints = []
+        self.tracks = []
+        self.vias = []
+
+    def get_footprints_hash(self):
+        return {fp.ref: fp for fp in self.footprints}
+
+    def parse_paper(self, e, e_type):
+        self.paper = _check_str(e, 1, e_type) if e_type == 'paper' else _check_symbol(e, 1, e_type)
+        if self.paper == 'User':
+            self.paper_w = _check_float(e, 2, e_type)
+            self.paper_h = _check_float(e, 3, e_type)
+        else:
+            if self.paper not in PAGE_SIZE:
+                raise PCBError('Unknown paper size selected {}'.format(self.paper))
+            size = PAGE_SIZE[self.paper]
+            if len(e) > 2 and _check_symbol(e, 2, e_type) == 'portrait':
+                self.paper_portrait = True
+                self.paper_w = size[0]
+                self.paper_h = size[1]
+            else:
+                self.paper_w = size[1]
+                self.paper_h = size[0]
+
+    def parse_title_block(self, items):
+        for i in items[1:]:
+            i_type = _check_is_symbol_list(i)
+            if i_type == 'comment':
+                num = _check_integer(i, 1, 'title block comment')
+                if num >= 1 and num <= 9:
+                    self.comments[num-1] = _check_relaxed(i, 2, 'title block comment')
+            elif i_type in ('title', 'date', 'rev', 'company'):
+                setattr(self, i_type, _check_relaxed(i, 1, 'title block '+i_type))
+
+    def parse_setup(self, items):
+        for i in items[1:]:
+            if isinstance(i, list) and _check_is_symbol_list(i) == 'aux_axis_origin':
+                self.aux_origin = _get_xy_iu(i, 'aux_axis_origin')
+                break
 
     @staticmethod
     def load(file):
@@ -49,23 +365,25 @@ class PCB(object):
         if not isinstance(pcb, list) or pcb[0].value() != 'kicad_pcb':
             raise PCBError('No kicad_pcb signature')
         o = PCB()
-        for e in pcb[1:]:
-            e_type = _check_is_symbol_list(e)
-            if e_type == 'paper' or e_type == 'page':
-                o.paper = _check_str(e, 1, e_type) if e_type == 'paper' else _check_symbol(e, 1, e_type)
-                if o.paper == 'User':
-                    o.paper_w = _check_float(e, 2, e_type)
-                    o.paper_h = _check_float(e, 3, e_type)
-                else:
-                    if o.paper not in PAGE_SIZE:
-                        raise PCBError('Unknown paper size selected {}'.format(o.paper))
-                    size = PAGE_SIZE[o.paper]
-                    if len(e) > 2 and _check_symbol(e, 2, e_type) == 'portrait':
-                        o.paper_portrait = True
-                        o.paper_w = size[0]
-                        o.paper_h = size[1]
-                    else:
-                        o.paper_w = size[1]
-                        o.paper_h = size[0]
-                break
+        try:
+            for e in pcb[1:]:
+                e_type = _check_is_symbol_list(e)
+                if e_type == 'version':
+                    o.version = _check_integer(e, 1, e_type)
+                elif e_type == 'paper' or e_type == 'page':
+                    o.parse_paper(e, e_type)
+                elif e_type == 'title_block':
+                    o.parse_title_block(e)
+                elif e_type == 'layers':
+                    o.layers = [BoardLayer.parse(la) for la in e[1:]]
+                elif e_type == 'setup':
+                    o.parse_setup(e)
+                elif e_type == 'module' or e_type == 'footprint':
+                    o.footprints.append(PCBFootprint.parse(e, o.version))
+                elif e_type == 'segment' or e_type == 'arc':
+                    o.tracks.append(PCBTrack.parse(e))
+                elif e_type == 'via':
+                    o.vias.append(PCBVia.parse(e))
+        except SchError as e:
+            raise PCBError(str(e))
         return o
@@ -14,7 +14,7 @@ import os
 from xml.etree.ElementTree import Element, SubElement, tostring
 from xml.dom import minidom
 from datetime import datetime
-from copy import deepcopy
+from copy import copy
 from collections import OrderedDict
 from .config import KiConf, un_quote
 from ..gs import GS
@@ -888,6 +888,9 @@ class SchematicComponent(object):
         self.dfields = {}
         self.fields_bkp = None
         self.dfields_bkp = None
+        # Fields shared with the back-up or other components (copy-on-write)
+        self._cow_fields = set()
+        self._fields_changed = False
         # Will be computed
         self.fitted = True
         self.included = True
@@ -924,7 +927,7 @@ class SchematicComponent(object):
         """ Change the value for an existing field """
         field_lc = field.lower()
         if field_lc in self.dfields:
-            target = self.dfields[field_lc]
+            target = self._own_field(field_lc)
             target.value = value
             # Adjust special fields
             if target.number < 4:
@@ -947,26 +950,54 @@ class SchematicComponent(object):
     def add_field(self, field):
         self.fields.append(field)
         self.dfields[field.name.lower()] = field
+        self._fields_changed = True
 
     def rename_field(self, old_name, new_name):
         old_name = old_name.lower()
-        field = self.dfields[old_name]
+        field = self._own_field(old_name)
         field.name = new_name
         del self.dfields[old_name]
         self.dfields[new_name.lower()] = field
 
+    def _own_field(self, field_lc):
+        """ Returns the field, making a private copy if it's shared """
+        field = self.dfields[field_lc]
+        self._fields_changed = True
+        if id(field) not in self._cow_fields:
+            return field
+        new_field = copy(field)
+        self.fields[self.fields.index(field)] = new_field
+        self.dfields[field_lc] = new_field
+        return new_field
+
     def back_up_fields(self):
         """ First call makes a back-up of the fields.
-            Next calls restores the back-up. """
+            Next calls restores the back-up.
+            The fields are shared with the back-up and copied only when modified. """
         if self.fields_bkp:
             # We have a back-up, restore from it
-            self.fields = deepcopy(self.fields_bkp)
-            self.dfields = {f.name.lower(): f for f in self.fields}
-            self._solve_fields(LineReader(None, '**Internal**'))
+            if self._fields_changed:
+                self.fields = list(self.fields_bkp)
+                self.dfields = self.dfields_bkp.copy()
+                self._solve_fields(LineReader(None, '**Internal**'))
+                self._fields_changed = False
         else:
             # No back-up. Make one for the next reset
-            self.fields_bkp = deepcopy(self.fields)
+            self.fields_bkp = tuple(self.fields)
             self.dfields_bkp = {f.name.lower(): f for f in self.fields_bkp}
+            self._cow_fields.update(map(id, self.fields_bkp))
+            self._fields_changed = False
+
+    def shallow_copy(self):
+        """ Creates a copy of the component that shares the fields until they are modified """
+        new_comp = copy(self)
+        new_comp.fields = list(self.fields)
+        new_comp.dfields = self.dfields.copy()
+        new_comp.fields_bkp = new_comp.dfields_bkp = None
+        shared = set(map(id, self.fields))
+        self._cow_fields.update(shared)
+        new_comp._cow_fields = shared
+        return new_comp
 
     def _solve_ref(self, path):
         """ Look for the correct reference for this path.
@@ -11,9 +11,12 @@ Main KiBot code
 
 import os
 import re
+import tempfile
+from multiprocessing import get_context
+from multiprocessing.connection import wait as mp_wait
 from sys import exit
 from sys import path as sys_path
-from shutil import which
+from shutil import which, rmtree
 from subprocess import run, PIPE
 from glob import glob
 from distutils.version import StrictVersion
@@ -23,20 +26,24 @@ from collections import OrderedDict
 from .gs import GS
 from .registrable import RegOutput
 from .misc import (PLOT_ERROR, MISSING_TOOL, CMD_EESCHEMA_DO, URL_EESCHEMA_DO, CORRUPTED_PCB,
-                   EXIT_BAD_ARGS, CORRUPTED_SCH, EXIT_BAD_CONFIG, WRONG_INSTALL, UI_SMD, UI_VIRTUAL, TRY_INSTALL_CHECK,
-                   MOD_SMD, MOD_THROUGH_HOLE, MOD_VIRTUAL, W_PCBNOSCH, W_NONEEDSKIP, W_WRONGCHAR, name2make, W_TIMEOUT,
+                   EXIT_BAD_ARGS, CORRUPTED_SCH, EXIT_BAD_CONFIG, WRONG_INSTALL, TRY_INSTALL_CHECK,
+                   W_PCBNOSCH, W_NONEEDSKIP, W_WRONGCHAR, name2make, W_TIMEOUT,
                    W_KIAUTO, W_VARSCH, NO_SCH_FILE, NO_PCB_FILE, W_VARPCB, NO_YAML_MODULE, WRONG_ARGUMENTS)
 from .error import PlotError, KiPlotConfigurationError, config_error, trace_dump
 from .config_reader import CfgYamlReader
+from .display_pool import DisplayPool
 from .pre_base import BasePreFlight
 from .kicad.v5_sch import Schematic, SchFileError, SchError
 from .kicad.v6_sch import SchematicV6
+from .kicad.pcb import PCB, PCBError
 from .kicad.config import KiConfError
 from . import log
 
 logger = log.get_logger()
 # Cache to avoid running external many times to check their versions
 script_versions = {}
+# Virtual displays shared by the KiAuto tools, see get_display_pool
+display_pool = None
 actions_loaded = False
 
 try:
@@ -174,13 +181,29 @@ def extract_errors(text):
         logger.warning(W_KIAUTO+msg.rstrip())
 
 
+def get_display_pool():
+    """ Virtual displays shared by the KiAuto tools, None if disabled """
+    global display_pool
+    if display_pool is None and GS.global_kiauto_shared_displays:
+        display_pool = DisplayPool(int(GS.global_kiauto_shared_displays))
+    return display_pool
+
+
 def exec_with_retry(cmd):
     logger.debug('Executing: '+str(cmd))
     if GS.debug_level > 2:
         logger.debug('Command line: '+' '.join(cmd))
+    pool = get_display_pool()
+    if pool is None:
+        return _exec_with_retry(cmd, None)
+    with pool.environment() as env:
+        return _exec_with_retry(cmd, env)
+
+
+def _exec_with_retry(cmd, env):
     retry = 2
     while retry:
-        result = run(cmd, stdout=PIPE, stderr=PIPE, universal_newlines=True)
+        result = run(cmd, stdout=PIPE, stderr=PIPE, universal_newlines=True, env=env)
         ret = result.returncode
         retry -= 1
         if ret != 16 and (ret > 0 and ret < 128 and retry):
@@ -248,6 +271,24 @@ def load_board(pcb_file=None):
     return board
 
 
+def load_pcb():
+    """ Loads the PCB using our own parser.
+        Much faster than pcbnew, but only useful to get information (footprints, pads, tracks, etc.) """
+    if GS.pcb is not None:
+        # Already loaded
+        return GS.pcb
+    GS.check_pcb()
+    try:
+        GS.pcb = PCB.load(GS.pcb_file)
+    except PCBError as e:
+        trace_dump()
+        logger.error('Error loading PCB file. Corrupted?')
+        logger.error(e)
+        exit(CORRUPTED_PCB)
+    logger.debug("PCB data loaded")
+    return GS.pcb
+
+
 def load_any_sch(file, project):
     if file[-9:] == 'kicad_sch':
         sch = SchematicV6()
@@ -291,36 +332,36 @@ def get_board_comps_data(comps):
         Note that we do it every time the function is called to reset transformation filters like rot_footprint. """
     if not GS.pcb_file:
         return
-    load_board()
+    # We don't need pcbnew for this, just the data from the file
+    pcb = load_pcb()
     comps_hash = {c.ref: c for c in comps}
-    for m in GS.get_modules():
-        ref = m.GetReference()
+    for m in pcb.footprints:
+        ref = m.ref
         if ref not in comps_hash:
             logger.warning(W_PCBNOSCH + '`{}` component in board, but not in schematic'.format(ref))
             continue
         c = comps_hash[ref]
-        c.bottom = m.IsFlipped()
-        c.footprint_rot = m.GetOrientationDegrees()
-        center = GS.get_center(m)
-        c.footprint_x = center.x
-        c.footprint_y = center.y
-        (c.footprint_w, c.footprint_h) = GS.get_fp_size(m)
-        attrs = m.GetAttributes()
+        c.bottom = m.bottom
+        c.footprint_rot = GS.normalize_fp_angle(m.angle)
+        c.footprint_x = m.x
+        c.footprint_y = m.y
+        # KiCad 5 uses the rotated pads, KiCad 6 uses GetFpPadsLocalBbox
+        (c.footprint_w, c.footprint_h) = m.get_pads_size(local=GS.ki6())
         if GS.ki5():
             # KiCad 5
-            if attrs == UI_SMD:
+            if m.smd:
                 c.smd = True
-            elif attrs == UI_VIRTUAL:
+            elif m.virtual:
                 c.virtual = True
             else:
                 c.tht = True
         else:
             # KiCad 6
-            if attrs & MOD_SMD:
+            if m.smd:
                 c.smd = True
-            if attrs & MOD_THROUGH_HOLE:
+            if m.tht:
                 c.tht = True
-            if attrs & MOD_VIRTUAL == MOD_VIRTUAL:
+            if m.virtual:
                 c.virtual = True
 
 
@@ -366,7 +407,7 @@ def config_output(out, dry=False, dont_stop=False):
         return True
     # Should we load the PCB?
     if not dry:
-        if out.is_pcb():
+        if out.is_pcb() and not out._native_pcb:
             load_board()
         if out.is_sch():
             load_sch()
@@ -409,6 +450,72 @@ def run_output(out, dont_stop=False):
             raise
 
 
+def _run_output_child(out, conn):
+    """ Runs `out` in a forked process (see run_outputs).
+        The warnings and filters stats are sent to the parent using `conn` """
+    log.MyLogger.start_child()
+    # The multiprocessing children don't call the atexit handlers, so the temporal files are created in a
+    # private dir, removed when we finish
+    tempfile.tempdir = tempfile.mkdtemp(prefix='tmp-kibot-'+out.name+'-')
+    try:
+        run_output(out)
+    finally:
+        rmtree(tempfile.tempdir, ignore_errors=True)
+        conn.send(log.MyLogger.get_child_stats())
+        conn.close()
+
+
+def run_outputs(outs):
+    """ Runs the outputs that aren't already done.
+        Outputs that collect files from other outputs (i.e. compress) run last, in this process.
+        When enabled by the `parallel_outputs` global option the rest are generated concurrently, using
+        forked processes, one per CPU. """
+    pending = []
+    last = []
+    for out in outs:
+        if not out._done and out not in pending and out not in last:
+            (last if hasattr(out.options, 'get_files') else pending).append(out)
+    workers = min(len(pending), os.cpu_count() or 1) if GS.global_parallel_outputs else 0
+    if workers < 2:
+        last = pending+last
+        pending = []
+    else:
+        # Start the shared displays before forking
+        get_display_pool()
+    ctx = get_context('fork')
+    running = {}
+    error = 0
+    while pending or running:
+        while pending and len(running) < workers and not error:
+            out = pending.pop(0)
+            logger.debug('Starting `{}` in a new process'.format(out))
+            r, w = ctx.Pipe(duplex=False)
+            p = ctx.Process(target=_run_output_child, args=(out, w))
+            p.start()
+            w.close()
+            running[r] = (p, out)
+        if not running:
+            break
+        # The children send their stats just before finishing, a closed pipe means the child died
+        for r in mp_wait(list(running.keys())):
+            p, out = running.pop(r)
+            try:
+                log.MyLogger.add_child_stats(r.recv())
+            except EOFError:
+                pass
+            r.close()
+            p.join()
+            if p.exitcode:
+                # The error was already reported by the child
+                error = error or p.exitcode
+            else:
+                out._done = True
+    if error:
+        exit(error if error > 0 else PLOT_ERROR)
+    for out in last:
+        run_output(out)
+
+
 def generate_outputs(outputs, target, invert, skip_pre, cli_order, dont_stop=False):
     logger.debug("Starting outputs for board {}".format(GS.pcb_file))
     preflight_checks(skip_pre)
@@ -775,6 +882,7 @@ def generate_one_example(dest_dir, types):
         return None
     # Reset the board and schematic
     GS.board = None
+    GS.pcb = None
     GS.sch = None
     # Create the config
     with open(fname, 'wt') as f:
@@ -849,6 +957,7 @@ def generate_targets(config_file):
     """ Generate all possible targets for the configuration file """
     # Reset the board and schematic
     GS.board = None
+    GS.pcb = None
     GS.sch = None
     # Reset the list of outputs
     RegOutput.reset()
@@ -931,3 +1040,4 @@ def generate_examples(start_dir, dry, types):
 # To avoid circular dependencies: Optionable needs it, but almost everything needs Optionable
 GS.load_board = load_board
 GS.load_sch = load_sch
+GS.load_pcb = load_pcb
@@ -10,6 +10,7 @@ Log module
 Handles logging initialization and formatting.
 """
 import io
+import json
 import os
 import sys
 import traceback
@@ -29,6 +30,8 @@ domain = 'kilog'
 filters = None
 root_logger = None
 visual_level = None
+# Filters and variants profiling: (kind, name) -> FilterStats
+filters_stats = {}
 
 
 def get_logger(name=None):
@@ -54,15 +57,72 @@ def set_filters(f):
     filters = f
 
 
+class FilterStats(object):
+    """ Profiling data for a filter or variant """
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.evaluated = 0
+        self.accepted = 0
+        self.time = 0.0
+
+    def to_dict(self):
+        return {'kind': self.kind, 'name': self.name, 'evaluated': self.evaluated, 'accepted': self.accepted,
+                'rejected': self.evaluated-self.accepted, 'time': self.time}
+
+
+def add_filter_stats(kind, name, evaluated, accepted, time):
+    """ Accumulates the profiling data for a filter or variant """
+    key = (kind, name)
+    stats = filters_stats.get(key)
+    if stats is None:
+        stats = filters_stats[key] = FilterStats(kind, name)
+    stats.evaluated += evaluated
+    stats.accepted += accepted
+    stats.time += time
+
+
 class MyLogger(logging.Logger):
     warn_hash = {}
     warn_tcnt = warn_cnt = n_filtered = 0
+    # Warnings inherited by a forked process, see start_child
+    child_base = {}
 
     @staticmethod
     def reset_warn_hash():
         """ Clean the hash, used for testing """
         MyLogger.warn_hash = {}
 
+    @staticmethod
+    def start_child():
+        """ Called by a forked process, so get_child_stats() reports only the warnings and stats of the child """
+        MyLogger.warn_tcnt = MyLogger.warn_cnt = MyLogger.n_filtered = 0
+        MyLogger.child_base = dict(MyLogger.warn_hash)
+        filters_stats.clear()
+
+    @staticmethod
+    def get_child_stats():
+        """ Warnings and filters profiling data collected by a forked process, used by add_child_stats() """
+        base = MyLogger.child_base
+        warns = {k: v-base.get(k, 0) for k, v in MyLogger.warn_hash.items() if v != base.get(k, 0)}
+        filters = [(s.kind, s.name, s.evaluated, s.accepted, s.time) for s in filters_stats.values()]
+        return MyLogger.warn_tcnt, MyLogger.n_filtered, warns, filters
+
+    @staticmethod
+    def add_child_stats(stats):
+        """ Accumulates the data collected by a forked process (get_child_stats()) """
+        warn_tcnt, n_filtered, warns, filters = stats
+        MyLogger.warn_tcnt += warn_tcnt
+        MyLogger.n_filtered += n_filtered
+        for msg, cnt in warns.items():
+            if msg not in MyLogger.warn_hash:
+                # A new unique warning
+                MyLogger.warn_cnt += 1
+                MyLogger.warn_hash[msg] = 0
+            MyLogger.warn_hash[msg] += cnt
+        for f in filters:
+            add_filter_stats(*f)
+
     def warning(self, msg, *args, **kwargs):
         MyLogger.warn_tcnt += 1
         # Get the message applying optional C style expansions
@@ -114,6 +174,21 @@ class MyLogger(logging.Logger):
                 filt_msg = ', {} filtered'.format(MyLogger.n_filtered)
             self.info('Found {} unique warning/s ({} total{})'.format(MyLogger.warn_cnt, MyLogger.warn_tcnt, filt_msg))
 
+    def log_filters_stats(self, json_file=None):
+        """ Prints a summary of the filters and variants profiling data, optionally stored as JSON """
+        if not filters_stats:
+            return
+        stats = sorted(filters_stats.values(), key=lambda s: s.time, reverse=True)
+        name_w = max(len('Name'), max(len(s.name) for s in stats))
+        fmt = '{:<9} {:<'+str(name_w)+'} {:>10} {:>10} {:>10} {:>10}'
+        self.info('Filters and variants statistics:')
+        self.info(fmt.format('Kind', 'Name', 'Evaluated', 'Accepted', 'Rejected', 'Time [s]'))
+        for s in stats:
+            self.info(fmt.format(s.kind, s.name, s.evaluated, s.accepted, s.evaluated-s.accepted, '{:.4f}'.format(s.time)))
+        if json_file:
+            with open(json_file, 'wt') as f:
+                json.dump([s.to_dict() for s in stats], f, indent=2)
+
     def findCaller(self, stack_info=False, stacklevel=1):
         f = sys._getframe(1)
         # Skip frames from logging module
@@ -240,6 +240,7 @@ W_WRONGOAR = '(W087) '
 W_ECCLASST = '(W088) '
 W_PDMASKFAIL = '(W089) '
 W_MISSTOOL = '(W090) '
+W_NODISPLAY = '(W091) '
 # Somehow arbitrary, the colors are real, but can be different
 PCB_MAT_COLORS = {'fr1': "937042", 'fr2': "949d70", 'fr3': "adacb4", 'fr4': "332B16", 'fr5': "6cc290"}
 PCB_FINISH_COLORS = {'hal': "8b898c", 'hasl': "8b898c", 'imag': "8b898c", 'enig': "cfb96e", 'enepig': "cfb96e",
@@ -21,7 +21,7 @@ else:
     from pcbnew import EDGE_MODULE, wxPoint, LSET
 from .registrable import RegOutput
 from .optionable import Optionable, BaseOptions
-from .fil_base import BaseFilter, apply_fitted_filter, reset_filters
+from .fil_base import BaseFilter, apply_filters
 from .kicad.config import KiConf
 from .macros import macros, document  # noqa: F401
 from .error import KiPlotConfigurationError
@@ -59,6 +59,8 @@ class BaseOutput(RegOutput):
         self._none_related = False
         self._unkown_is_error = True
         self._done = False
+        # True for PCB outputs that only need the data from our own PCB parser (no pcbnew board loaded)
+        self._native_pcb = False
 
     @staticmethod
     def attr2longopt(attr):
@@ -449,11 +451,5 @@ class VariantOptions(BaseOptions):
         # Get the components list from the schematic
         comps = GS.sch.get_components()
         get_board_comps_data(comps)
-        # Apply the filter
-        reset_filters(comps)
-        apply_fitted_filter(comps, self.dnf_filter)
-        # Apply the variant
-        if self.variant:
-            # Apply the variant
-            comps = self.variant.filter(comps)
-        self._comps = comps
+        # Apply the filter and the variant
+        self._comps = apply_filters(comps, self.variant, dnf_filter=self.dnf_filter)
@@ -9,6 +9,7 @@ This is somehow compatible with KiBoM.
 """
 import os
 import re
+import json
 from copy import deepcopy
 from .gs import GS
 from .misc import W_BADFIELD, W_NEEDSPCB, DISTRIBUTORS, ToolDependency, ToolDependencyRole, URL_KICOST
@@ -17,11 +18,10 @@ from .registrable import RegOutput, RegDependency
 from .error import KiPlotConfigurationError
 from .kiplot import get_board_comps_data, load_any_sch
 from .bom.columnlist import ColumnList, BoMError
-from .bom.bom import do_bom
+from .bom.bom import do_bom, group_components
 from .bom.xlsx_writer import KICOST_SUPPORT
 from .var_kibom import KiBoM
-from .fil_base import (BaseFilter, apply_exclude_filter, apply_fitted_filter, apply_fixed_filter, reset_filters,
-                       KICOST_NAME_TRANSLATIONS)
+from .fil_base import BaseFilter, apply_filters, KICOST_NAME_TRANSLATIONS
 from .macros import macros, document, output_class  # noqa: F401
 from . import log
 # To debug the `with document` we can use:
@@ -29,6 +29,11 @@ from . import log
 # with step_expansion:
 
 logger = log.get_logger()
+# Options that only affects the BoM writers, not the groups
+FORMAT_OPTIONS = {'output', 'format', 'columns', 'cost_extra_columns', 'html', 'xlsx', 'csv', 'distributors',
+                  'no_distributors', 'count_smd_tht'}
+# Stats computed by group_components
+STATS = ('n_groups', 'n_total', 'n_total_smd', 'n_total_tht', 'n_fitted', 'n_fitted_smd', 'n_fitted_tht', 'n_build')
 VALID_STYLES = {'modern-blue', 'modern-green', 'modern-red', 'classic'}
 DEFAULT_ALIASES = [['r', 'r_small', 'res', 'resistor'],
                    ['l', 'l_small', 'inductor'],
@@ -366,7 +371,15 @@ class Aggregate(Optionable):
             self.name = os.path.splitext(os.path.basename(self.file))[0]
 
 
+class BoMGroups(object):
+    """ Groups computed by a BoM output, can be shared with other BoM outputs """
+    pass
+
+
 class BoMOptions(BaseOptions):
+    # Groups computed by the BoM outputs, indexed by get_groups_fingerprint()
+    _groups_cache = {}
+
     def __init__(self):
         with document:
             self.number = 1
@@ -478,6 +491,8 @@ class BoMOptions(BaseOptions):
         self._format_example = 'CSV'
         self._footprint_populate_values_example = 'no,yes'
         self._footprint_type_values_example = 'SMD,THT,VIRTUAL'
+        # Accessors used to compute the rows, see bom.get_row_getters
+        self._row_getters = {}
         super().__init__()
 
     @staticmethod
@@ -686,35 +701,44 @@ class BoMOptions(BaseOptions):
             comps.extend(new_comps)
             prj.source = os.path.basename(prj.file)
 
-    def run(self, output):
-        format = self.format.lower()
-        # Add some info needed for the output to the config object.
-        # So all the configuration is contained in one object.
-        self.source = GS.sch_basename
-        self.date = GS.sch_date
-        self.revision = GS.sch_rev
-        self.debug_level = GS.debug_level
-        self.kicad_version = GS.kicad_version
-        self.conv_units = GS.unit_name_to_scale_factor(self.units)
+    def get_groups_fingerprint(self):
+        """ A string identifying the options that affects the groups and stats, but not the format """
+        tree = {k: v for k, v in self._tree.items() if k not in FORMAT_OPTIONS}
+        return json.dumps(tree, sort_keys=True, default=str)
+
+    @staticmethod
+    def get_comps_state(comps):
+        """ Things that other outputs can change and affects the groups """
+        return [(c.ref, c.value, c.included, c.fitted, c.fixed) for c in comps]
+
+    def get_cached_groups(self, fingerprint):
+        """ Looks for groups computed by other BoM using the same options """
+        cached = BoMOptions._groups_cache.get(fingerprint)
+        if cached is None or cached.sch is not GS.sch or cached.pcb is not GS.pcb:
+            return None
+        if self.get_comps_state(cached.comps) != cached.state:
+            return None
+        logger.debug('Using the groups computed for `{}`'.format(cached.name))
+        for name in STATS:
+            setattr(self, name, getattr(cached.cfg, name))
+        self.aggregate = cached.aggregate
+        for g in cached.groups:
+            g.cfg = self
+        return cached
+
+    def compute_groups(self):
+        """ Loads the components, applies the filters and variants, and groups them """
         # Get the components list from the schematic
         comps = GS.sch.get_components()
         get_board_comps_data(comps)
-        if self.count_smd_tht and not GS.pcb_file:
-            logger.warning(W_NEEDSPCB+"`count_smd_tht` is enabled, but no PCB provided")
-            self.count_smd_tht = False
         # Apply the reference prefix
         for c in comps:
             c.ref = self.ref_id+c.ref
             c.ref_id = self.ref_id
         # Aggregate components from other projects
         self.aggregate_comps(comps)
-        # Apply all the filters
-        reset_filters(comps)
-        apply_exclude_filter(comps, self.exclude_filter)
-        apply_fitted_filter(comps, self.dnf_filter)
-        apply_fixed_filter(comps, self.dnc_filter)
-        # Apply the variant
-        comps = self.variant.filter(comps)
+        # Apply all the filters and the variant
+        comps = apply_filters(comps, self.variant, self.exclude_filter, self.dnf_filter, self.dnc_filter)
         # We add the main project to the aggregate list so do_bom sees a complete list
         base_sch = Aggregate()
         base_sch.file = GS.sch_file
@@ -723,19 +747,59 @@ class BoMOptions(BaseOptions):
         base_sch.number = self.number
         base_sch.sch = GS.sch
         self.aggregate.insert(0, base_sch)
-        # To translate project to ID
-        if self.source_by_id:
-            self.source_to_id = {prj.name: prj.ref_id for prj in self.aggregate}
+        # Group components according to group_fields
+        cached = BoMGroups()
+        cached.name = self._parent.name
+        cached.cfg = self
+        cached.comps = comps
+        cached.groups = group_components(self, comps)
+        cached.aggregate = self.aggregate
+        cached.sch = GS.sch
+        cached.pcb = GS.pcb
+        return cached
+
+    def run(self, output):
+        format = self.format.lower()
+        # Add some info needed for the output to the config object.
+        # So all the configuration is contained in one object.
+        self.source = GS.sch_basename
+        self.date = GS.sch_date
+        self.revision = GS.sch_rev
+        self.debug_level = GS.debug_level
+        self.kicad_version = GS.kicad_version
+        self.conv_units = GS.unit_name_to_scale_factor(self.units)
+        if self.count_smd_tht and not GS.pcb_file:
+            logger.warning(W_NEEDSPCB+"`count_smd_tht` is enabled, but no PCB provided")
+            self.count_smd_tht = False
+        # BoMs using the same options, but a different format, share the groups
+        fingerprint = self.get_groups_fingerprint()
+        cached = self.get_cached_groups(fingerprint)
+        if cached is None:
+            cached = self.compute_groups()
+        else:
+            # Apply the reference prefix
+            for c in filter(lambda c: c.project == GS.sch_basename, cached.comps):
+                c.ref = self.ref_id+c.ref
+                c.ref_id = self.ref_id
+        comps = cached.comps
         try:
-            do_bom(output, format, comps, self)
+            # To translate project to ID
+            if self.source_by_id:
+                self.source_to_id = {prj.name: prj.ref_id for prj in self.aggregate}
+            do_bom(output, format, cached.groups, self)
         except BoMError as e:
             raise KiPlotConfigurationError(str(e))
-        # Undo the reference prefix
-        if self.ref_id:
-            l_id = len(self.ref_id)
-            for c in filter(lambda c: c.project == GS.sch_basename, comps):
-                c.ref = c.ref[l_id:]
-                c.ref_id = ''
+        finally:
+            # Undo the reference prefix, even on errors
+            if self.ref_id:
+                l_id = len(self.ref_id)
+                for c in filter(lambda c: c.project == GS.sch_basename, comps):
+                    c.ref = c.ref[l_id:]
+                    c.ref_id = ''
+        # Used to check if other outputs changed the components.
+        # Stored only after a successful run, the cached entries always have a state.
+        cached.state = self.get_comps_state(comps)
+        BoMOptions._groups_cache[fingerprint] = cached
 
     def get_targets(self, out_dir):
         return [self._parent.expand_filename(out_dir, self.output)]
@@ -7,13 +7,26 @@ import re
 import os
 import glob
 import sys
+import bz2
+import json
+import lzma
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from gzip import GzipFile
+from hashlib import sha1
+from functools import partial
+from io import BytesIO
 from sys import exit
 from subprocess import check_output, STDOUT, CalledProcessError
-from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA
-from tarfile import open as tar_open
+import zipfile
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED, ZIP_BZIP2, ZIP_LZMA, ZIP64_LIMIT
+from zlib import crc32, compressobj, DEFLATED, MAX_WBITS
+from tarfile import open as tar_open, LNKTYPE
+from tempfile import NamedTemporaryFile
 from collections import OrderedDict
 from .gs import GS
-from .kiplot import config_output, get_output_dir, run_output
+from .kiplot import config_output, get_output_dir, run_outputs
 from .misc import (MISSING_TOOL, WRONG_INSTALL, W_EMPTYZIP, WRONG_ARGUMENTS, INTERNAL_ERROR, ToolDependency,
                    ToolDependencyRole, TRY_INSTALL_CHECK)
 from .optionable import Optionable, BaseOptions
@@ -25,6 +38,149 @@ logger = log.get_logger()
 RegDependency.register(ToolDependency('compress', 'RAR', 'https://www.rarlab.com/',
                                       url_down='https://www.rarlab.com/download.htm', help_option='-?',
                                       roles=ToolDependencyRole(desc='Compress in RAR format')))
+# Size of the TAR chunks compressed by each thread
+TAR_BLOCK_SIZE = 8*1024*1024
+# Bigger files are added to ZIP archives by zipfile, not compressed in memory by the threads
+ZIP_PARALLEL_MAX_SIZE = 8*1024*1024
+# Size of the chunks used to copy compressed data between ZIP files
+ZIP_COPY_CHUNK = 1024*1024
+# ZIP member listing the files removed by the `deduplicate` option
+DUPLICATES_MANIFEST = 'duplicated_files.json'
+
+
+def _get_compressor(compression, level):
+    """ Same streams generated by zipfile """
+    if compression == ZIP_DEFLATED:
+        # Raw deflate stream
+        return compressobj(level, DEFLATED, -MAX_WBITS)
+    if compression == ZIP_BZIP2:
+        return bz2.BZ2Compressor(level)
+    # LZMA needs a special header, implemented by zipfile
+    return zipfile.LZMACompressor()
+
+
+def _compress_member(fname, compression, level):
+    """ Returns the compressed data (as a list of chunks), CRC, size and compressed size for a ZIP member """
+    with open(fname, 'rb') as f:
+        data = f.read()
+    crc = crc32(data)
+    size = len(data)
+    if compression != ZIP_STORED:
+        compressor = _get_compressor(compression, level)
+        data = compressor.compress(data)+compressor.flush()
+    return [data], crc, size, len(data)
+
+
+def _read_compressed(zip, zinfo):
+    """ Returns the compressed data for a member of `zip` (an iterator of chunks), CRC, size and compressed size """
+    zip.fp.seek(zinfo.header_offset)
+    # The local header is 30 bytes long, followed by the name and the extra field
+    name_len, extra_len = struct.unpack('<HH', zip.fp.read(30)[26:])
+    zip.fp.seek(name_len+extra_len, 1)
+    return _read_chunks(zip.fp, zinfo.compress_size), zinfo.CRC, zinfo.file_size, zinfo.compress_size
+
+
+def _read_chunks(f, size):
+    while size:
+        data = f.read(min(size, ZIP_COPY_CHUNK))
+        if not data:
+            raise zipfile.BadZipFile('Truncated member')
+        size -= len(data)
+        yield data
+
+
+def _member_name(dest):
+    """ Name used by ZipFile.write and TarFile.add for `dest` """
+    name = os.path.normpath(os.path.splitdrive(dest)[1]).lstrip(os.sep)
+    return name.replace(os.sep, '/') if os.sep != '/' else name
+
+
+def _hash_file(fname):
+    hash = sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), b''):
+            hash.update(block)
+    return hash.hexdigest()
+
+
+def _can_write_compressed(zip):
+    """ Adding already compressed data needs some ZipFile internals, not available in all the Python versions """
+    return (sys.version_info >= (3, 7) and all(hasattr(zip, a) for a in ('fp', 'start_dir', 'NameToInfo', '_didModify')) and
+            hasattr(zipfile, 'LZMACompressor'))
+
+
+def _write_compressed(zip, fname, dest, chunks, crc, size, compress_size):
+    """ Adds an already compressed member to the ZIP file (like ZipFile.write, but without compressing) """
+    zinfo = ZipInfo.from_file(fname, dest)
+    zinfo.compress_type = zip.compression
+    if zinfo.compress_type == ZIP_LZMA:
+        # Compressed data with EOS marker
+        zinfo.flag_bits |= 0x02
+    zinfo.CRC = crc
+    zinfo.file_size = size
+    zinfo.compress_size = compress_size
+    zip.fp.seek(zip.start_dir)
+    zinfo.header_offset = zip.fp.tell()
+    zip.fp.write(zinfo.FileHeader(size > ZIP64_LIMIT or compress_size > ZIP64_LIMIT))
+    for data in chunks:
+        zip.fp.write(data)
+    zip.filelist.append(zinfo)
+    zip.NameToInfo[zinfo.filename] = zinfo
+    zip.start_dir = zip.fp.tell()
+    zip._didModify = True
+
+
+def _ordered_map(executor, func, args, window):
+    """ Like executor.map, but only `window` jobs are submitted in advance (bounded memory) """
+    pending = deque()
+    for arg in args:
+        pending.append(executor.submit(func, *arg))
+        if len(pending) > window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _gzip_compress(data, level):
+    buf = BytesIO()
+    # mtime=0: the result only depends on the data
+    with GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+class BlockCompressor(object):
+    """ File-like object used to create compressed TAR files.
+        The data is split in blocks compressed in parallel, each block is an independent gzip/bzip2/xz stream.
+        The decompressors handle a sequence of streams as one. """
+    def __init__(self, fileobj, compress, executor, window):
+        self.fileobj = fileobj
+        self.compress = compress
+        self.executor = executor
+        self.window = window
+        self.buffer = []
+        self.size = 0
+        self.pending = deque()
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= TAR_BLOCK_SIZE:
+            self.submit()
+        return len(data)
+
+    def submit(self):
+        self.pending.append(self.executor.submit(self.compress, b''.join(self.buffer)))
+        self.buffer = []
+        self.size = 0
+        while len(self.pending) > self.window:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.size:
+            self.submit()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().result())
 
 
 class FilesList(Optionable):
@@ -57,6 +213,11 @@ class CompressOptions(BaseOptions):
                 'deflated': 'gz',
                 'bzip2': 'bz2',
                 'lzma': 'xz'}
+    # Equivalent TAR_MODE for the ZIP algorithms, used to select the compression level
+    ZIP_MODE = {ZIP_STORED: '',
+                ZIP_DEFLATED: 'gz',
+                ZIP_BZIP2: 'bz2',
+                ZIP_LZMA: 'xz'}
 
     def __init__(self):
         with document:
@@ -66,10 +227,25 @@ class CompressOptions(BaseOptions):
             """ [ZIP,TAR,RAR] Output file format """
             self.compression = 'auto'
             """ [auto,stored,deflated,bzip2,lzma] Compression algorithm. Use auto to let KiBot select a suitable one """
+            self.compression_level = -1
+            """ [-1,9] Compression level. Use -1 for the default (9 for deflated and bzip2, 6 for lzma).
+                Not used for RAR files and the lzma algorithm of ZIP files """
+            self.threads = 0
+            """ Number of threads used to compress ZIP and TAR files. Use 0 to use one thread for each CPU """
             self.files = FilesList
             """ [list(dict)] Which files will be included """
             self.move_files = False
             """ Move the files to the archive. In other words: remove the files after adding them to the archive """
+            self.incremental = False
+            """ Update the archive only when the files changed. A manifest with the size, time and hash of each
+                file is stored next to the archive (`.manifest` extension).
+                ZIP archives reuse the compressed data of the files that didn't change.
+                TAR and RAR archives are created again when something changed """
+            self.deduplicate = False
+            """ Store files with the same content only once.
+                TAR archives use hard links for the copies. ZIP archives include a `duplicated_files.json` file
+                listing the copies and the stored file (this name is reserved).
+                RAR archives store the copies as references (needs RAR 5) """
             self.remove_files = None
             """ {move_files} """
         super().__init__()
@@ -81,29 +257,111 @@ class CompressOptions(BaseOptions):
             logger.warning(W_EMPTYZIP+'No files provided, creating an empty archive')
         self._expand_id = parent.name
         self._expand_ext = self.solve_extension()
+        self._threads = int(self.threads) if self.threads > 0 else (os.cpu_count() or 1)
+
+    def get_level(self, mode):
+        """ Compression level for the `mode` (TAR_MODE) algorithm """
+        if self.compression_level < 0:
+            return 6 if mode == 'xz' else 9
+        level = int(self.compression_level)
+        # bzip2 levels are 1 to 9
+        return max(level, 1) if mode == 'bz2' else level
+
+    def add_to_zip(self, zip, files, reuse, level):
+        if (self._threads < 2 and not reuse) or not _can_write_compressed(zip):
+            for fname, dest in files.items():
+                logger.debug('Adding '+fname+' as '+dest)
+                zip.write(fname, dest)
+            return
+        # Compress the small files in parallel, add them in order.
+        # The big ones are compressed by zipfile, to avoid loading them in memory.
+        reuse = reuse or {}
+        parallel = {fname for fname in files.keys() if fname not in reuse and os.path.isfile(fname) and
+                    os.path.getsize(fname) <= ZIP_PARALLEL_MAX_SIZE}
+        args = [(fname, zip.compression, level) for fname in files.keys() if fname in parallel]
+        with ThreadPoolExecutor(max_workers=self._threads) as executor:
+            results = _ordered_map(executor, _compress_member, args, 2*self._threads)
+            for fname, dest in files.items():
+                logger.debug('Adding '+fname+' as '+dest)
+                if fname in reuse:
+                    _write_compressed(zip, fname, dest, *_read_compressed(*reuse[fname]))
+                elif fname in parallel:
+                    _write_compressed(zip, fname, dest, *next(results))
+                else:
+                    zip.write(fname, dest)
 
-    def create_zip(self, output, files):
+    def create_zip(self, output, files, reuse=None, dups=None):
+        """ `reuse` maps source files to the members of a previous archive with the same content (ZipFile, ZipInfo).
+            `dups` maps source files to the destination of another file with the same content """
+        if dups:
+            files = OrderedDict((fname, dest) for fname, dest in files.items() if fname not in dups)
+            if DUPLICATES_MANIFEST in map(_member_name, files.values()):
+                logger.error('The `{}` file name is used by the `deduplicate` option, rename the file'.
+                             format(DUPLICATES_MANIFEST))
+                exit(WRONG_ARGUMENTS)
         extra = {}
         extra['compression'] = self.ZIP_ALGORITHMS[self.compression]
+        level = self.get_level(self.ZIP_MODE[extra['compression']])
         if sys.version_info >= (3, 7):
-            extra['compresslevel'] = 9
+            extra['compresslevel'] = level
         with ZipFile(output, 'w', **extra) as zip:
-            for fname, dest in files.items():
-                logger.debug('Adding '+fname+' as '+dest)
-                zip.write(fname, dest)
+            self.add_to_zip(zip, files, reuse, level)
+            if dups:
+                zip.writestr(DUPLICATES_MANIFEST, json.dumps({_member_name(dest): _member_name(orig)
+                                                              for dest, orig in dups.values()}, indent=1))
 
-    def create_tar(self, output, files):
-        with tar_open(output, 'w:'+self.TAR_MODE[self.compression]) as tar:
-            for fname, dest in files.items():
+    @staticmethod
+    def add_to_tar(tar, files, dups):
+        for fname, dest in files.items():
+            if fname in dups:
+                logger.debug('Adding '+fname+' as '+dest+' (link to '+dups[fname][1]+')')
+                info = tar.gettarinfo(fname, dest)
+                info.type = LNKTYPE
+                info.linkname = _member_name(dups[fname][1])
+                info.size = 0
+                tar.addfile(info)
+            else:
                 logger.debug('Adding '+fname+' as '+dest)
                 tar.add(fname, dest)
 
-    def create_rar(self, output, files):
+    def create_tar(self, output, files, dups=None):
+        dups = dups or {}
+        mode = self.TAR_MODE[self.compression]
+        level = self.get_level(mode)
+        if not mode or self._threads < 2:
+            extra = {'preset': level} if mode == 'xz' else {'compresslevel': level} if mode else {}
+            with tar_open(output, 'w:'+mode, **extra) as tar:
+                self.add_to_tar(tar, files, dups)
+            return
+        if mode == 'gz':
+            compress = partial(_gzip_compress, level=level)
+        elif mode == 'bz2':
+            compress = partial(bz2.compress, compresslevel=level)
+        else:
+            compress = partial(lzma.compress, preset=level)
+        with open(output, 'wb') as f, ThreadPoolExecutor(max_workers=self._threads) as executor:
+            blocks = BlockCompressor(f, compress, executor, 2*self._threads)
+            # Stream mode, the TAR is written sequentially
+            with tar_open(fileobj=blocks, mode='w|') as tar:
+                self.add_to_tar(tar, files, dups)
+            blocks.close()
+
+    def create_rar(self, output, files, dups=None):
         if os.path.isfile(output):
             os.remove(output)
+        # The -ap option applies to all the files, so we use one rar call for each destination directory
+        groups = OrderedDict()
         for fname, dest in files.items():
             logger.debug('Adding '+fname+' as '+dest)
-            cmd = ['rar', 'a', '-m5', '-ep', '-ap'+os.path.dirname(dest), output, fname]
+            groups.setdefault(os.path.dirname(dest), []).append(fname)
+        for dest_dir, fnames in groups.items():
+            # Pass the names using a list file, no matter how many we have
+            with NamedTemporaryFile(mode='w', suffix='.lst', encoding='utf-8', delete=False) as f:
+                f.write('\n'.join(fnames)+'\n')
+            cmd = ['rar', 'a', '-m5', '-ep', '-scfl', '-ap'+dest_dir, output, '@'+f.name]
+            if dups:
+                # Identical files as references, only for the files in the same call
+                cmd.insert(2, '-oi')
             try:
                 check_output(cmd, stderr=STDOUT)
             except FileNotFoundError:
@@ -115,6 +373,8 @@ class CompressOptions(BaseOptions):
                 if e.output:
                     logger.debug('Output from command: '+e.output.decode())
                 exit(WRONG_INSTALL)
+            finally:
+                os.remove(f.name)
 
     def solve_extension(self):
         if self.format == 'ZIP':
@@ -130,13 +390,16 @@ class CompressOptions(BaseOptions):
 
     def get_files(self, output, no_out_run=False):
         output_real = os.path.realpath(output)
+        manifest_real = self.get_manifest_name(output_real)
         files = OrderedDict()
         out_dir_cwd = os.getcwd()
         out_dir_default = self.expand_filename_sch(GS.out_dir)
         dirs_list = []
+        sources = []
+        missing = []
         for f in self.files:
             # Get the list of candidates
-            files_list = None
+            out = None
             if f.from_output:
                 out = RegOutput.get_output(f.from_output)
                 if out is not None:
@@ -148,26 +411,28 @@ class CompressOptions(BaseOptions):
                 else:
                     logger.error('Unknown output `{}` selected in {}'.format(f.from_output, self._parent))
                     exit(WRONG_ARGUMENTS)
-                if not no_out_run:
-                    for file in files_list:
-                        if not os.path.isfile(file):
-                            # The target doesn't exist
-                            if not out._done:
-                                # The output wasn't created in this run, try running it
-                                run_output(out)
-                            if not os.path.isfile(file):
-                                # Still missing, something is wrong
-                                logger.error('Unable to generate `{}` from {}'.format(file, out))
-                                exit(INTERNAL_ERROR)
+                if not no_out_run and not all(os.path.isfile(file) for file in files_list):
+                    # Some target doesn't exist, try running the output
+                    missing.append(out)
             else:
                 out_dir = out_dir_cwd if f.from_cwd else out_dir_default
                 source = f.expand_filename_both(f.source, make_safe=False)
                 files_list = glob.iglob(os.path.join(out_dir, source), recursive=True)
+            sources.append((f, out, files_list))
+        # Generate the missing outputs, concurrently when possible
+        run_outputs(missing)
+        for f, out, files_list in sources:
+            if out is not None and not no_out_run:
+                for file in files_list:
+                    if not os.path.isfile(file):
+                        # Still missing, something is wrong
+                        logger.error('Unable to generate `{}` from {}'.format(file, out))
+                        exit(INTERNAL_ERROR)
             # Filter and adapt them
             for fname in filter(re.compile(f.filter).match, files_list):
                 fname_real = os.path.realpath(fname)
                 # Avoid including the output
-                if fname_real == output_real:
+                if fname_real == output_real or fname_real == manifest_real:
                     continue
                 # Compute the destination directory inside the archive
                 dest = fname
@@ -187,18 +452,121 @@ class CompressOptions(BaseOptions):
         files, _ = self.get_files(output, no_out_run=True)
         return files.keys()
 
+    @staticmethod
+    def get_manifest_name(output):
+        return output+'.manifest'
+
+    def get_manifest_options(self):
+        """ Options that affect the archive content """
+        return [self.format, self.compression, self.compression_level, self.deduplicate]
+
+    def load_manifest(self, output):
+        """ Returns the manifest for `output`, None if missing or not applicable """
+        try:
+            with open(self.get_manifest_name(output), 'rt') as f:
+                manifest = json.load(f)
+            if (manifest['options'] != self.get_manifest_options() or not os.path.isfile(output) or
+               os.path.getsize(output) != manifest['size']):
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return manifest
+
+    def hash_files(self, fnames):
+        """ Computes the hash for the `fnames` files, using a pool of threads """
+        if not fnames:
+            return {}
+        with ThreadPoolExecutor(max_workers=self._threads) as executor:
+            return dict(zip(fnames, executor.map(_hash_file, fnames)))
+
+    def find_duplicates(self, files, hashes=None):
+        """ Returns a dict for the files with the same content of a previous file.
+            The values are tuples with the destination of the copy and the destination of the stored file """
+        # Empty files aren't worth the effort
+        regular = [fname for fname in files.keys() if os.path.isfile(fname) and os.path.getsize(fname)]
+        if hashes is None:
+            hashes = self.hash_files(regular)
+        stored = {}
+        dups = OrderedDict()
+        for fname in regular:
+            dest = stored.setdefault(hashes[fname], files[fname])
+            if dest != files[fname]:
+                dups[fname] = (files[fname], dest)
+        logger.debug('{} duplicated files'.format(len(dups)))
+        return dups
+
+    def get_manifest_files(self, files, manifest):
+        """ Returns the manifest entries for `files`. The hashes are reused if the size and time didn't change """
+        old = {e['source']: e for e in manifest['files']} if manifest else {}
+        entries = []
+        to_hash = []
+        for fname, dest in files.items():
+            entry = {'source': fname, 'dest': dest}
+            if os.path.isfile(fname):
+                st = os.stat(fname)
+                entry['size'] = st.st_size
+                entry['mtime'] = st.st_mtime_ns
+                prev = old.get(fname)
+                if prev and prev.get('size') == entry['size'] and prev.get('mtime') == entry['mtime']:
+                    entry['hash'] = prev['hash']
+                else:
+                    to_hash.append(entry)
+            entries.append(entry)
+        hashes = self.hash_files([e['source'] for e in to_hash])
+        for entry in to_hash:
+            entry['hash'] = hashes[entry['source']]
+        return entries
+
+    def create_archive(self, output, files, hashes=None):
+        dups = self.find_duplicates(files, hashes) if self.deduplicate else None
+        if self.format == 'ZIP':
+            self.create_zip(output, files, dups=dups)
+        elif self.format == 'TAR':
+            self.create_tar(output, files, dups)
+        elif self.format == 'RAR':
+            self.create_rar(output, files, dups)
+
+    def update_archive(self, output, files):
+        """ Incremental mode, creates the archive only if the files changed """
+        manifest = self.load_manifest(output)
+        entries = self.get_manifest_files(files, manifest)
+        hashes = {e['source']: e['hash'] for e in entries if 'hash' in e}
+        if manifest is None:
+            self.create_archive(output, files, hashes)
+        elif [(e['dest'], e.get('hash')) for e in entries] == [(e['dest'], e.get('hash')) for e in manifest['files']]:
+            logger.debug('`{}` is up to date'.format(output))
+        elif self.format == 'ZIP':
+            # Copy the compressed data for the files with the same name and content
+            old = {(e['dest'], e.get('hash')): e for e in manifest['files'] if 'hash' in e}
+            tmp = output+'.tmp'
+            with ZipFile(output) as zip:
+                members = {m.filename: m for m in zip.infolist()}
+                reuse = {}
+                for e in entries:
+                    prev = old.get((e['dest'], e.get('hash')))
+                    member = members.get(_member_name(e['dest'])) if prev else None
+                    if member is not None and member.compress_type == self.ZIP_ALGORITHMS[self.compression]:
+                        reuse[e['source']] = (zip, member)
+                logger.debug('Reusing {} files from `{}`'.format(len(reuse), output))
+                self.create_zip(tmp, files, reuse, self.find_duplicates(files, hashes) if self.deduplicate else None)
+            os.replace(tmp, output)
+        else:
+            # Compressed TAR streams and RAR archives can't be partially updated
+            self.create_archive(output, files, hashes)
+        manifest = {'options': self.get_manifest_options(), 'size': os.path.getsize(output), 'files': entries}
+        with open(self.get_manifest_name(output), 'wt') as f:
+            json.dump(manifest, f, indent=1)
+
     def run(self, output):
         # Output file name
         logger.debug('Collecting files')
         # Collect the files
         files, dirs_outs = self.get_files(output)
         logger.debug('Generating `{}` archive'.format(output))
-        if self.format == 'ZIP':
-            self.create_zip(output, files)
-        elif self.format == 'TAR':
-            self.create_tar(output, files)
-        elif self.format == 'RAR':
-            self.create_rar(output, files)
+        if self.incremental:
+            self.update_archive(output, files)
+        else:
+            self.create_archive(output, files)
         if self.move_files:
             dirs = dirs_outs
             for fname in files.keys():
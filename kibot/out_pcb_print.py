@@ -8,9 +8,11 @@
 import re
 import os
 import subprocess
+from atexit import register as atexit_register
 from pcbnew import B_Cu, F_Cu, FromMM, IsCopperLayer, PLOT_CONTROLLER, PLOT_FORMAT_SVG, wxSize, F_Mask, B_Mask, ZONE_FILLER
-from shutil import rmtree, which
+from shutil import rmtree, which, copy2
 from tempfile import NamedTemporaryFile, mkdtemp
+from concurrent.futures import ThreadPoolExecutor
 from .svgutils.transform import fromstring, RectElement, fromfile
 from .error import KiPlotConfigurationError
 from .gs import GS
@@ -21,10 +23,9 @@ from .kicad.patch_svg import patch_svg_file
 from .kicad.worksheet import Worksheet, WksError
 from .kicad.config import KiConf
 from .kicad.v5_sch import SchError
-from .kicad.pcb import PCB
 from .misc import (CMD_PCBNEW_PRINT_LAYERS, URL_PCBNEW_PRINT_LAYERS, PDF_PCB_PRINT, MISSING_TOOL, W_PDMASKFAIL,
                    KICAD5_SVG_SCALE, W_MISSTOOL, ToolDependency, ToolDependencyRole, TRY_INSTALL_CHECK)
-from .kiplot import check_script, exec_with_retry, add_extra_options
+from .kiplot import check_script, exec_with_retry, add_extra_options, load_pcb
 from .registrable import RegDependency
 from .create_pdf import create_pdf_from_pages
 from .macros import macros, document, output_class  # noqa: F401
@@ -42,6 +43,14 @@ POLY_FILL_STYLE = ("fill:{0}; fill-opacity:1.0; stroke:{0}; stroke-width:1; stro
                    "stroke-linejoin:round;fill-rule:evenodd;")
 DRAWING_LAYERS = ['Dwgs.User', 'Cmts.User', 'Eco1.User', 'Eco2.User']
 EXTRA_LAYERS = ['F.Fab', 'B.Fab', 'F.CrtYd', 'B.CrtYd']
+# Plot options we don't set, but can be changed by other outputs
+PO_EXTRA_GETTERS = ['GetSubtractMaskFromSilk', 'GetPlotMode', 'GetSketchPadsOnFabLayers', 'GetExcludeEdgeLayer']
+# PcbDraw solder masks, see PCB_PrintOptions.get_pcbdraw_masks
+pcbdraw_cache = {}
+# Layers already plotted during this run, see PCB_PrintOptions.plot_layer
+plot_cache = {}
+plot_cache_dir = None
+plot_cache_board = None
 RegDependency.register(ToolDependency('pcb_print', 'RSVG tools',
                                       'https://cran.r-project.org/web/packages/rsvg/index.html', deb='librsvg2-bin',
                                       command=SVG2PDF,
@@ -54,6 +63,12 @@ RegDependency.register(ToolDependency('pcb_print', 'ImageMagick', 'https://image
 RegDependency.register(ToolDependency('pcb_print', 'LXML', is_python=True))
 
 
+def remove_plot_cache(pid):
+    # Forked processes (see kiplot.run_outputs) inherit the handler, the cache belongs to its creator
+    if os.getpid() == pid:
+        rmtree(plot_cache_dir, ignore_errors=True)
+
+
 def _run_command(cmd):
     logger.debug('- Executing: '+str(cmd))
     try:
@@ -67,6 +82,32 @@ def _run_command(cmd):
         logger.debug('- Output from command:\n'+cmd_output.decode())
 
 
+def _run_one(cmd):
+    res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    return res.returncode, res.stdout
+
+
+def _run_commands(cmds):
+    """ Runs a list of independent commands concurrently, one for each CPU.
+        The results are checked in order, any error aborts the execution """
+    if len(cmds) < 2:
+        for cmd in cmds:
+            _run_command(cmd)
+        return
+    for cmd in cmds:
+        logger.debug('- Executing: '+str(cmd))
+    with ThreadPoolExecutor(max_workers=min(len(cmds), os.cpu_count() or 1)) as executor:
+        results = list(executor.map(_run_one, cmds))
+    for cmd, (ret, output) in zip(cmds, results):
+        if ret:
+            logger.error('Failed to run %s, error %d', cmd[0], ret)
+            if output:
+                logger.debug('Output from command: '+output.decode())
+            exit(PDF_PCB_PRINT)
+        if output.strip():
+            logger.debug('- Output from command {}:\n{}'.format(cmd, output.decode()))
+
+
 def hex_to_rgb(value):
     """ Return (red, green, blue) in float between 0-1 for the color given as #rrggbb. """
     value = value.lstrip('#')
@@ -89,22 +130,61 @@ def to_gray_hex(color):
 
 
 def load_svg(file, color, colored_holes, holes_color, monochrome):
-    with open(file, 'rt') as f:
+    """ Loads the SVG, as bytes, applying all the color changes in one pass """
+    with open(file, 'rb') as f:
         content = f.read()
     color = color[:7]
     if monochrome:
         color = to_gray_hex(color)
         holes_color = to_gray_hex(holes_color)
+    replace = {}
     if colored_holes:
-        content = content.replace('#FFFFFF', '**black_hole**')
+        replace[b'#FFFFFF'] = holes_color.encode()
     if color != '#000000':
         # Files plotted
-        content = content.replace('#000000', color)
+        replace[b'#000000'] = color.encode()
         # Files generated by "Print"
-        content = content.replace('stroke:rgb(0%,0%,0%)', 'stroke:'+color)
-    if colored_holes:
-        content = content.replace('**black_hole**', holes_color)
-    return content
+        replace[b'stroke:rgb(0%,0%,0%)'] = b'stroke:'+color.encode()
+    if not replace:
+        return content
+    colors_re = re.compile(b'|'.join(re.escape(k) for k in replace))
+    return colors_re.sub(lambda m: replace[m.group(0)], content)
+
+
+def pcbdraw_key(bottom):
+    """ Key for the PcbDraw solder masks cache, changes if the PCB file changes """
+    st = os.stat(GS.pcb_file)
+    return (GS.pcb_file, st.st_mtime_ns, st.st_size, bottom)
+
+
+def filter_pcbdraw_mask(pcbdraw_file):
+    """ Filters the PcbDraw SVG to get only the solder mask.
+        Returns the SVG as bytes, the transform and color must be applied to the `boardContainer` group.
+        Returns None if we fail to find the elements """
+    svg = fromfile(pcbdraw_file)
+    defs = None
+    g = None
+    for child in svg.root:
+        if child.tag.endswith('}defs'):
+            # Keep the cut-off and pads-mask-silkscreen defs
+            defs = child
+            logger.debug(' - Found <defs>')
+            for df in child:
+                if df.get('id') not in ['cut-off', 'pads-mask-silkscreen']:
+                    child.remove(df)
+        elif child.tag.endswith('}g') and child.get('id') == "boardContainer":
+            # Keep the solder mask
+            g = child
+            g_mask = g[0]
+            if g_mask.get('clip-path') == "url(#cut-off)" and g_mask.get('mask') == "url(#hole-mask)":
+                logger.debug(' - Found clip-path')
+                g_mask.set('mask', "url(#pads-mask-silkscreen)")
+                for gf in g_mask:
+                    if gf.get('id') != 'substrate-board':
+                        g_mask.remove(gf)
+    if g is None or defs is None:
+        return None
+    return svg.to_str()
 
 
 def get_size(svg):
@@ -113,23 +193,20 @@ def get_size(svg):
     return float(view_box[2]), float(view_box[3])
 
 
-def svg_to_pdf(input_folder, svg_file, pdf_file):
+def svg_to_pdf_cmd(input_folder, svg_file, pdf_file):
     # Note: rsvg-convert uses 90 dpi but KiCad (and the docs I found) says SVG pt is 72 dpi
-    cmd = [SVG2PDF, '-d', '72', '-p', '72', '-f', 'pdf', '-o', os.path.join(input_folder, pdf_file),
-           os.path.join(input_folder, svg_file)]
-    _run_command(cmd)
+    return [SVG2PDF, '-d', '72', '-p', '72', '-f', 'pdf', '-o', os.path.join(input_folder, pdf_file),
+            os.path.join(input_folder, svg_file)]
 
 
-def svg_to_png(input_folder, svg_file, png_file, width):
-    cmd = [SVG2PDF, '-w', str(width), '-f', 'png', '-o', os.path.join(input_folder, png_file),
-           os.path.join(input_folder, svg_file)]
-    _run_command(cmd)
+def svg_to_png_cmd(input_folder, svg_file, png_file, width):
+    return [SVG2PDF, '-w', str(width), '-f', 'png', '-o', os.path.join(input_folder, png_file),
+            os.path.join(input_folder, svg_file)]
 
 
-def svg_to_eps(input_folder, svg_file, eps_file):
-    cmd = [SVG2PDF, '-d', '72', '-p', '72', '-f', 'eps', '-o', os.path.join(input_folder, eps_file),
-           os.path.join(input_folder, svg_file)]
-    _run_command(cmd)
+def svg_to_eps_cmd(input_folder, svg_file, eps_file):
+    return [SVG2PDF, '-d', '72', '-p', '72', '-f', 'eps', '-o', os.path.join(input_folder, eps_file),
+            os.path.join(input_folder, svg_file)]
 
 
 def pdf_to_ps(ps_file, output):
@@ -139,10 +216,13 @@ def pdf_to_ps(ps_file, output):
 
 def create_pdf_from_svg_pages(input_folder, input_files, output_fn):
     svg_files = []
+    cmds = []
     for svg_file in input_files:
         pdf_file = svg_file.replace('.svg', '.pdf')
-        svg_to_pdf(input_folder, svg_file, pdf_file)
+        cmds.append(svg_to_pdf_cmd(input_folder, svg_file, pdf_file))
         svg_files.append(os.path.join(input_folder, pdf_file))
+    # The pages are converted concurrently, but merged in order
+    _run_commands(cmds)
     create_pdf_from_pages(svg_files, output_fn)
 
 
@@ -751,7 +831,7 @@ class PCB_PrintOptions(VariantOptions):
         svg_out.save(os.path.join(output_folder, output_file))
 
     def find_paper_size(self):
-        pcb = PCB.load(GS.pcb_file)
+        pcb = load_pcb()
         self.paper_w = pcb.paper_w
         self.paper_h = pcb.paper_h
         self.paper = pcb.paper
@@ -767,9 +847,17 @@ class PCB_PrintOptions(VariantOptions):
                 self.plot_vias(la, pc, p, filelist, VIATYPE_BLIND_BURIED, self.blind_via_color)
                 self.plot_vias(la, pc, p, filelist, VIATYPE_MICROVIA, self.micro_via_color)
 
-    def plot_realistic_solder_mask(self, id, temp_dir, out_file, color, mirror, scale):
-        """ Plot the solder mask closer to reality, not the apertures """
-        if not self.realistic_solder_mask or (id != F_Mask and id != B_Mask):
+    def get_mask_sides(self):
+        """ Solder masks used by the pages (True for bottom), only when using `realistic_solder_mask` """
+        if not self.realistic_solder_mask:
+            return set()
+        return {la._id == B_Mask for p in self.pages for la in p.layers if la._id in (F_Mask, B_Mask)}
+
+    def get_pcbdraw_masks(self, sides):
+        """ Runs PcbDraw to get the solder masks for the indicated sides (True for bottom).
+            The filtered results are cached, the missing sides are generated concurrently. """
+        missing = [bottom for bottom in sides if pcbdraw_key(bottom) not in pcbdraw_cache]
+        if not missing:
             return
         logger.debug('- Plotting realistic solder mask using PcbDraw')
         # Check PcbDraw is available
@@ -778,19 +866,37 @@ class PCB_PrintOptions(VariantOptions):
             logger.error(TRY_INSTALL_CHECK)
             exit(MISSING_TOOL)
         # Run PcbDraw to make the heavy work (find the Edge.Cuts path and create masks)
-        pcbdraw_file = os.path.join(temp_dir, out_file.replace('.svg', '-pcbdraw.svg'))
-        cmd = ['pcbdraw', '--no-warn-back', '-f', '']
-        if id == B_Mask:
-            cmd.append('-b')
-        cmd.extend([GS.pcb_file, pcbdraw_file])
-        _run_command(cmd)
+        temp_dir = mkdtemp(prefix='tmp-kibot-pcbdraw-')
+        cmds = []
+        files = []
+        for bottom in missing:
+            pcbdraw_file = os.path.join(temp_dir, 'bottom.svg' if bottom else 'top.svg')
+            cmd = ['pcbdraw', '--no-warn-back', '-f', '']
+            if bottom:
+                cmd.append('-b')
+            cmd.extend([GS.pcb_file, pcbdraw_file])
+            cmds.append(cmd)
+            files.append(pcbdraw_file)
+        _run_commands(cmds)
+        for bottom, pcbdraw_file in zip(missing, files):
+            pcbdraw_cache[pcbdraw_key(bottom)] = filter_pcbdraw_mask(pcbdraw_file)
+        rmtree(temp_dir)
+
+    def plot_realistic_solder_mask(self, id, temp_dir, out_file, color, mirror, scale):
+        """ Plot the solder mask closer to reality, not the apertures """
+        if not self.realistic_solder_mask or (id != F_Mask and id != B_Mask):
+            return
+        bottom = id == B_Mask
+        self.get_pcbdraw_masks([bottom])
+        mask = pcbdraw_cache[pcbdraw_key(bottom)]
+        if mask is None:
+            logger.warning(W_PDMASKFAIL+'Failed to extract elements from the PcbDraw SVG')
+            return
         # Load the SVG created by PcbDraw
-        with open(pcbdraw_file, 'rt') as f:
-            svg = fromstring(f.read())
+        svg = fromstring(mask)
         # Load the plot file from KiCad to get the real coordinates system
         out_file = os.path.join(temp_dir, out_file)
-        with open(out_file, 'rt') as f:
-            svg_kicad = fromstring(f.read())
+        svg_kicad = fromfile(out_file)
         view_box = svg_kicad.root.get('viewBox')
         view_box_elements = view_box.split(' ')
         # This is the paper size using the SVG precision
@@ -815,38 +921,19 @@ class PCB_PrintOptions(VariantOptions):
         else:
             if mirror:
                 transform = 'scale(-1,1) translate({},0)'.format(-paper_size_x)
-        # Filter the PcbDraw SVG to get what we want
-        defs = None
-        g = None
+        # Apply the transform and our color to the solder mask
         for child in svg.root:
-            if child.tag.endswith('}defs'):
-                # Keep the cut-off and pads-mask-silkscreen defs
-                defs = child
-                logger.debug(' - Found <defs>')
-                for df in child:
-                    if df.get('id') not in ['cut-off', 'pads-mask-silkscreen']:
-                        child.remove(df)
-            elif child.tag.endswith('}g') and child.get('id') == "boardContainer":
-                # Keep the solder mask
-                g = child
-                g.set('transform', transform)
-                g_mask = g[0]
-                if g_mask.get('clip-path') == "url(#cut-off)" and g_mask.get('mask') == "url(#hole-mask)":
-                    logger.debug(' - Found clip-path')
-                    g_mask.set('mask', "url(#pads-mask-silkscreen)")
+            if child.tag.endswith('}g') and child.get('id') == "boardContainer":
+                child.set('transform', transform)
+                g_mask = child[0]
+                if g_mask.get('mask') == "url(#pads-mask-silkscreen)":
                     for gf in g_mask:
-                        if gf.get('id') != 'substrate-board':
-                            g_mask.remove(gf)
-                        else:
-                            # Apply our color to the solder mask
+                        if gf.get('id') == 'substrate-board':
                             alpha = 1.0
                             if len(color) == 9:
                                 alpha = int(color[7:], 16)/255
                                 color = color[:7]
                             gf.set('style', "fill:{0}; fill-opacity:{1}; stroke:{0};".format(color, alpha))
-        if g is None or defs is None:
-            logger.warning(W_PDMASKFAIL+'Failed to extract elements from the PcbDraw SVG')
-            return
         # Adjust the paper to what KiCad used
         svg.root.set('width', svg_kicad.root.get('width'))
         svg.root.set('height', svg_kicad.root.get('height'))
@@ -854,6 +941,50 @@ class PCB_PrintOptions(VariantOptions):
         # Save the filtered file
         svg.save(out_file)
 
+    def get_variant_key(self):
+        """ The components state, affects the crossed and removed components """
+        if not self._comps:
+            return None
+        return (self.hide_excluded, tuple((c.ref, c.fitted, c.included) for c in self._comps))
+
+    def get_plot_key(self, po, la, p):
+        """ Key used for the plot cache, all the options that can change the layer plot """
+        key = (la._id, p.sheet, p.mirror, p.scaling, p.negative_plot, p.tent_vias, la.plot_footprint_refs,
+               la.plot_footprint_values, la.force_plot_invisible_refs_vals, self._drill_marks if IsCopperLayer(la._id) else 0,
+               self._variant_key)
+        if GS.ki5():
+            key += (p.line_width, p.exclude_pads_from_silkscreen)
+        return key+tuple(getattr(po, g)() for g in PO_EXTRA_GETTERS if hasattr(po, g))
+
+    def plot_layer(self, pc, po, la, p, temp_dir):
+        """ Plots a layer to temp_dir, reusing a previous plot with the same options when available """
+        global plot_cache_dir, plot_cache_board
+        pc.SetLayer(la._id)
+        file = GS.pcb_basename+"-"+la.suffix+".svg"
+        dest = os.path.join(temp_dir, file)
+        if plot_cache_board is not GS.board:
+            # A new board, the plots aren't valid
+            plot_cache.clear()
+            plot_cache_board = GS.board
+        key = self.get_plot_key(po, la, p)
+        cached = plot_cache.get(key)
+        if cached is not None:
+            logger.debug('- Using the cached plot for layer {}'.format(la.layer))
+            copy2(cached, dest)
+            return file
+        pc.OpenPlotfile(la.suffix, PLOT_FORMAT_SVG, p.sheet)
+        pc.PlotLayer()
+        pc.ClosePlot()
+        # Keep a copy, the file can be modified (i.e. realistic solder mask)
+        if plot_cache_dir is None:
+            plot_cache_dir = mkdtemp(prefix='tmp-kibot-plot_cache-')
+            atexit_register(remove_plot_cache, os.getpid())
+        # Forked processes can share the directory
+        cached = os.path.join(plot_cache_dir, '{}-{}.svg'.format(os.getpid(), len(plot_cache)))
+        copy2(dest, cached)
+        plot_cache[key] = cached
+        return file
+
     def set_scaling(self, po, scaling):
         if scaling:
             po.SetScale(scaling)
@@ -884,6 +1015,8 @@ class PCB_PrintOptions(VariantOptions):
         logger.debug('Starting to generate `{}`'.format(output))
         logger.debug('- Temporal dir: {}'.format(temp_dir_base))
         self.find_paper_size()
+        # Get the realistic solder masks we need, concurrently
+        self.get_pcbdraw_masks(self.get_mask_sides())
         if self.sheet_reference_layout:
             layout = self.sheet_reference_layout
         else:
@@ -909,8 +1042,10 @@ class PCB_PrintOptions(VariantOptions):
                 edge_layer.color = layer_id2color[edge_id]
             else:
                 edge_layer.color = "#000000"
+        self._variant_key = self.get_variant_key()
         # Generate the output, page by page
         pages = []
+        cmds = []
         for n, p in enumerate(self.pages):
             # Use a dir for each page, avoid overwriting files, just for debug purposes
             page_str = "%02d" % (n+1)
@@ -939,11 +1074,7 @@ class PCB_PrintOptions(VariantOptions):
                 po.SetPlotInvisibleText(la.force_plot_invisible_refs_vals)
                 # Avoid holes on non-copper layers
                 po.SetDrillMarksType(self._drill_marks if IsCopperLayer(id) else 0)
-                pc.SetLayer(id)
-                pc.OpenPlotfile(la.suffix, PLOT_FORMAT_SVG, p.sheet)
-                pc.PlotLayer()
-                pc.ClosePlot()
-                filelist.append((GS.pcb_basename+"-"+la.suffix+".svg", la.color))
+                filelist.append((self.plot_layer(pc, po, la, p, temp_dir), la.color))
                 self.plot_extra_cu(id, la, pc, p, filelist)
                 self.plot_realistic_solder_mask(id, temp_dir, filelist[-1][0], filelist[-1][1], p.mirror, p.scaling)
             # 2) Plot the frame using an empty layer and 1.0 scale
@@ -970,11 +1101,13 @@ class PCB_PrintOptions(VariantOptions):
                 id = self._expand_id+('_page_'+page_str)
                 out_file = self.expand_filename(output_dir, self.output, id, self._expand_ext)
                 if self.format == 'PNG':
-                    svg_to_png(temp_dir, assembly_file, out_file, self.png_width)
+                    cmds.append(svg_to_png_cmd(temp_dir, assembly_file, out_file, self.png_width))
                 else:
-                    svg_to_eps(temp_dir, assembly_file, out_file)
+                    cmds.append(svg_to_eps_cmd(temp_dir, assembly_file, out_file))
             pages.append(os.path.join(page_str, assembly_file))
             self.restore_title()
+        # Convert all the pages to PNG/EPS
+        _run_commands(cmds)
         # Join all pages in one file
         if self.format in ['PDF', 'PS']:
             logger.debug('- Creating output file {}'.format(output))
@@ -10,7 +10,7 @@ from sys import exit
 from subprocess import check_output, STDOUT, CalledProcessError
 from .gs import GS
 from .error import KiPlotConfigurationError
-from .kiplot import config_output, get_output_dir, run_output
+from .kiplot import config_output, get_output_dir, run_outputs
 from .misc import MISSING_TOOL, WRONG_INSTALL, WRONG_ARGUMENTS, INTERNAL_ERROR, W_NOTPDF
 from .optionable import Optionable, BaseOptions
 from .registrable import RegOutput
@@ -61,9 +61,11 @@ class PDFUniteOptions(BaseOptions):
         files = []
         out_dir_cwd = os.getcwd()
         out_dir_default = self.expand_filename_pcb(GS.out_dir)
+        sources = []
+        missing = []
         for f in self.outputs:
             # Get the list of candidates
-            files_list = None
+            out = None
             if f.from_output:
                 out = RegOutput.get_output(f.from_output)
                 if out is not None:
@@ -72,21 +74,23 @@ class PDFUniteOptions(BaseOptions):
                 else:
                     logger.error('Unknown output `{}` selected in {}'.format(f.from_output, self._parent))
                     exit(WRONG_ARGUMENTS)
-                if not no_out_run:
-                    for file in files_list:
-                        if not os.path.isfile(file):
-                            # The target doesn't exist
-                            if not out._done:
-                                # The output wasn't created in this run, try running it
-                                run_output(out)
-                            if not os.path.isfile(file):
-                                # Still missing, something is wrong
-                                logger.error('Unable to generate `{}` from {}'.format(file, out))
-                                exit(INTERNAL_ERROR)
+                if not no_out_run and not all(os.path.isfile(file) for file in files_list):
+                    # Some target doesn't exist, try running the output
+                    missing.append(out)
             else:
                 out_dir = out_dir_cwd if f.from_cwd else out_dir_default
                 source = f.expand_filename_both(f.source, make_safe=False)
                 files_list = glob.iglob(os.path.join(out_dir, source), recursive=True)
+            sources.append((f, out, files_list))
+        # Generate the missing outputs, concurrently when possible
+        run_outputs(missing)
+        for f, out, files_list in sources:
+            if out is not None and not no_out_run:
+                for file in files_list:
+                    if not os.path.isfile(file):
+                        # Still missing, something is wrong
+                        logger.error('Unable to generate `{}` from {}'.format(file, out))
+                        exit(INTERNAL_ERROR)
             # Filter and adapt them
             for fname in filter(re.compile(f.filter).match, files_list):
                 fname_real = os.path.realpath(fname)
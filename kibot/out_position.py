@@ -10,7 +10,7 @@ from re import compile
 from datetime import datetime
 from collections import OrderedDict
 from .gs import GS
-from .misc import UI_SMD, UI_VIRTUAL, MOD_THROUGH_HOLE, MOD_SMD, MOD_EXCLUDE_FROM_POS_FILES
+from .kiplot import load_pcb
 from .optionable import Optionable
 from .out_base import VariantOptions
 from .error import KiPlotConfigurationError
@@ -185,26 +185,12 @@ class PositionOptions(VariantOptions):
             bothf.close()
 
     @staticmethod
-    def is_pure_smd_5(m):
-        return m.GetAttributes() == UI_SMD
+    def is_pure_smd(m):
+        return m.smd and not m.tht
 
     @staticmethod
-    def is_pure_smd_6(m):
-        return m.GetAttributes() & (MOD_THROUGH_HOLE | MOD_SMD) == MOD_SMD
-
-    @staticmethod
-    def is_not_virtual_5(m):
-        return m.GetAttributes() != UI_VIRTUAL
-
-    @staticmethod
-    def is_not_virtual_6(m):
-        return not (m.GetAttributes() & MOD_EXCLUDE_FROM_POS_FILES)
-
-    @staticmethod
-    def get_attr_tests():
-        if GS.ki5():
-            return PositionOptions.is_pure_smd_5, PositionOptions.is_not_virtual_5
-        return PositionOptions.is_pure_smd_6, PositionOptions.is_not_virtual_6
+    def is_not_virtual(m):
+        return not m.exclude_from_pos_files
 
     def get_targets(self, out_dir):
         ext = self._expand_ext
@@ -221,15 +207,15 @@ class PositionOptions(VariantOptions):
         # Format all strings
         comps_hash = self.get_refs_hash()
         modules = []
-        is_pure_smd, is_not_virtual = self.get_attr_tests()
         quote_char = '"' if self.format == 'CSV' else ''
         x_origin = 0.0
         y_origin = 0.0
         if self.use_aux_axis_as_origin:
             (x_origin, y_origin) = GS.get_aux_origin()
             logger.debug('Using auxiliary origin: x={} y={}'.format(x_origin, y_origin))
-        for m in sorted(GS.get_modules(), key=lambda c: _ref_key(c.GetReference())):
-            ref = m.GetReference()
+        # We just need the footprints data, no need to load the board using pcbnew
+        for m in sorted(load_pcb().footprints, key=lambda c: _ref_key(c.ref)):
+            ref = m.ref
             logger.debug('P&P ref: {}'.format(ref))
             value = None
             # Apply any filter or variant data
@@ -246,15 +232,15 @@ class PositionOptions(VariantOptions):
                     center_x = c.footprint_x
                     center_y = c.footprint_y
             if value is None:
-                value = m.GetValue()
-                footprint = str(m.GetFPID().GetLibItemName())  # pcbnew.UTF8 type
-                is_bottom = m.IsFlipped()
-                rotation = m.GetOrientationDegrees()
-                center = GS.get_center(m)
-                center_x = center.x
-                center_y = center.y
+                value = m.value
+                footprint = m.name
+                is_bottom = m.bottom
+                rotation = GS.normalize_fp_angle(m.angle)
+                center_x = m.x
+                center_y = m.y
             # If passed check the position options
-            if (self.only_smd and is_pure_smd(m)) or (not self.only_smd and (is_not_virtual(m) or self.include_virtual)):
+            if ((self.only_smd and self.is_pure_smd(m)) or
+               (not self.only_smd and (self.is_not_virtual(m) or self.include_virtual))):
                 # KiCad: PLACE_FILE_EXPORTER::GenPositionData() in export_footprints_placefile.cpp
                 row = []
                 for k in self.columns:
@@ -300,6 +286,7 @@ class Position(BaseOutput):  # noqa: F821
         with document:
             self.options = PositionOptions
             """ [dict] Options for the `position` output """
+        self._native_pcb = True
 
     @staticmethod
     def get_conf_examples(name, layers, templates):
@@ -384,6 +384,7 @@ class QR_LibOptions(BaseOptions):
                     with open(prl_name, 'rt') as f:
                         prl = f.read()
             GS.board.Save(GS.pcb_file)
+            GS.pcb = None
             if prl:
                 with open(prl_name, 'wt') as f:
                     f.write(prl)
@@ -223,6 +223,8 @@ class Annotate_PCB(BasePreFlight):  # noqa: F821
         logger.debug('- Saving PCB')
         GS.make_bkp(GS.pcb_file)
         GS.board.Save(GS.pcb_file)
+        # The PCB data must be parsed again
+        GS.pcb = None
         #
         # SCH part
         #
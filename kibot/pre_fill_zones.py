@@ -25,3 +25,5 @@ class Fill_Zones(BasePreFlight):  # noqa: F821
         pcbnew.ZONE_FILLER(GS.board).Fill(GS.board.Zones())
         GS.make_bkp(GS.pcb_file)
         GS.board.Save(GS.pcb_file)
+        # The PCB data must be parsed again
+        GS.pcb = None
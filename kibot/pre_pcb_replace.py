@@ -57,5 +57,6 @@ class PCB_Replace(Base_Replace):  # noqa: F821
             t._relax_check = True
             o.replace_tags.append(t)
         self.replace(GS.pcb_file)
-        # Force the schematic reload
+        # Force the PCB reload
         GS.board = None
+        GS.pcb = None
@@ -382,7 +382,7 @@ def fromstring(text):
 
     Parameters
     ----------
-    text : str
+    text : str or bytes
         string representing the SVG content. Must be valid SVG.
 
     Returns
@@ -392,7 +392,9 @@ def fromstring(text):
         content.
     """
     fig = SVGFigure()
-    svg = etree.fromstring(text.encode(), parser=etree.XMLParser(huge_tree=True))
+    if isinstance(text, str):
+        text = text.encode()
+    svg = etree.fromstring(text, parser=etree.XMLParser(huge_tree=True))
 
     fig.root = svg
 
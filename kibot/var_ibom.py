@@ -9,7 +9,7 @@ Implements the IBoM variants mechanism.
 from .optionable import Optionable
 from .gs import GS
 from .misc import IFILT_MECHANICAL
-from .fil_base import BaseFilter
+from .fil_base import BaseFilter, ComponentTable
 from .macros import macros, document, variant_class  # noqa: F401
 from . import log
 
@@ -45,16 +45,20 @@ class IBoM(BaseVariant):  # noqa: F821
         self.variants_blacklist = self.force_list(self.variants_blacklist)
         self.variants_whitelist = self.force_list(self.variants_whitelist)
 
+    def skip_variant(self, ref_variant):
+        """ Skip components with wrong variant field """
+        ref_variant = ref_variant.lower()
+        if self.variants_whitelist and ref_variant not in self.variants_whitelist:
+            return True
+        if self.variants_blacklist and ref_variant and ref_variant in self.variants_blacklist:
+            return True
+        return False
+
     def skip_component(self, c):
         """ Skip components that doesn't belong to this variant. """
         # Apply variants white/black lists
         if self.variant_field:
-            ref_variant = c.get_field_value(self.variant_field).lower()
-            # skip components with wrong variant field
-            if self.variants_whitelist and ref_variant not in self.variants_whitelist:
-                return True
-            if self.variants_blacklist and ref_variant and ref_variant in self.variants_blacklist:
-                return True
+            return self.skip_variant(c.get_field_value(self.variant_field))
         return False
 
     def filter(self, comps):
@@ -67,10 +71,13 @@ class IBoM(BaseVariant):  # noqa: F821
         # Apply to all the components
         for c in comps:
             logger.debug("{} {} {}".format(c.ref, c.fitted, c.included))
-            if not (c.fitted and c.included):
-                # Don't check if we already discarded it
-                continue
-            c.fitted = not self.skip_component(c)
+        if not self.variant_field:
+            # Nothing to skip
+            return comps
+        # Don't check if we already discarded it
+        table = ComponentTable([c for c in comps if c.fitted and c.included])
+        for c, skip in zip(table.comps, table.map(table.values('field', self.variant_field), self.skip_variant)):
+            c.fitted = not skip
             if not c.fitted and GS.debug_level > 2:
                 logger.debug('ref: {} value: {} -> False'.format(c.ref, c.value))
         return comps
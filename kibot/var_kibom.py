@@ -9,7 +9,7 @@ Implements the KiBoM variants mechanism.
 from .optionable import Optionable
 from .gs import GS
 from .misc import IFILT_MECHANICAL
-from .fil_base import BaseFilter
+from .fil_base import BaseFilter, ComponentTable
 from .macros import macros, document, variant_class  # noqa: F401
 from . import log
 
@@ -94,13 +94,12 @@ class KiBoM(BaseVariant):  # noqa: F821
         GS.variant = self.variant
         comps = super().filter(comps)
         logger.debug("Applying KiBoM style variants `{}`".format(self.name))
-        for c in comps:
-            if not (c.fitted and c.included):
-                # Don't check if we already discarded it
-                continue
-            config = c.get_field_value(self.config_field)
-            c.fitted = self.matches_variant(config)
-            if not c.fitted and GS.debug_level > 2:
+        # Don't check if we already discarded it
+        table = ComponentTable([c for c in comps if c.fitted and c.included])
+        configs = table.values('field', self.config_field)
+        for c, config, fitted in zip(table.comps, configs, table.map(configs, self.matches_variant)):
+            c.fitted = fitted
+            if not fitted and GS.debug_level > 2:
                 logger.debug('ref: {} config: {} variant: {} -> False'.
                              format(c.ref, config, self.variant))
         return comps
@@ -10,7 +10,7 @@ Implements the KiCost variants mechanism.
 import re
 from .gs import GS
 from .misc import IFILT_VAR_RENAME_KICOST, IFILT_KICOST_RENAME, IFILT_KICOST_DNP
-from .fil_base import BaseFilter
+from .fil_base import BaseFilter, ComponentTable
 from .macros import macros, document, variant_class  # noqa: F401
 from . import log
 
@@ -80,11 +80,11 @@ class KiCost(BaseVariant):  # noqa: F821
         # Apply to all the components
         for c in comps:
             logger.debug("{} fitted: {} included: {}".format(c.ref, c.fitted, c.included))
-            if not (c.fitted and c.included):
-                # Don't check if we already discarded it
-                continue
-            variants = c.get_field_value(self.variant_field)
-            c.fitted = self.matches_variant(variants)
-            if not c.fitted and GS.debug_level > 2:
-                logger.debug('ref: {} value: {} variants: {} -> False'.format(c.ref, c.value, variants))
+        # Don't check if we already discarded it
+        table = ComponentTable([c for c in comps if c.fitted and c.included])
+        variants = table.values('field', self.variant_field)
+        for c, c_variants, fitted in zip(table.comps, variants, table.map(variants, self.matches_variant)):
+            c.fitted = fitted
+            if not fitted and GS.debug_level > 2:
+                logger.debug('ref: {} value: {} variants: {} -> False'.format(c.ref, c.value, c_variants))
         return comps
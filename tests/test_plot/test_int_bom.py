@@ -1305,6 +1305,28 @@ def test_int_bom_variant_t2c(test_dir):
     ctx.clean_up()
 
 
+def test_int_bom_variant_shared_1(test_dir):
+    """ Outputs sharing the variant. The first changes R1 to 3k3, the second reuses its groups.
+        The other outputs must see the original value """
+    prj = 'kibom-variant_2'
+    ctx = context.TestContextSCH(test_dir, 'test_int_bom_variant_shared_1', prj, 'int_bom_shared_var_1', BOM_DIR)
+    ctx.run()
+    rows, header, info = ctx.load_csv(prj+'-bom.csv')
+    ref_column = header.index(REF_COLUMN_NAME)
+    val_column = header.index(VALUE_COLUMN_NAME)
+    check_kibom_test_netlist(rows, ref_column, 1, ['C1', 'C2'], ['R1', 'R2'])
+    check_value(rows, ref_column, 'R1', val_column, '1k')
+    rows, header, info = ctx.load_csv(prj+'-bom_(production).csv')
+    check_kibom_test_netlist(rows, ref_column, 2, ['C1'], ['R1', 'R2', 'C2'])
+    check_value(rows, ref_column, 'R1', val_column, '1k')
+    for suffix in ['', '_copy', '_again']:
+        rows, header, info = ctx.load_csv(prj+'-bom_(test)'+suffix+'.csv')
+        check_kibom_test_netlist(rows, ref_column, 2, ['R2'], ['R1', 'C1', 'C2'])
+        check_value(rows, ref_column, 'R1', val_column, '3k3')
+    ctx.search_err(r'Using the groups computed for `bom_internal_test`')
+    ctx.clean_up()
+
+
 def test_int_bom_variant_rename_1(test_dir):
     prj = 'f_rename_1'
     ctx = context.TestContextSCH(test_dir, 'test_int_bom_variant_rename_1', prj, 'int_bom_var_rename_1_csv', BOM_DIR)
@@ -1444,6 +1466,22 @@ def test_int_bom_fil_2(test_dir):
     ctx.clean_up(keep_project=True)
 
 
+def test_int_bom_fil_3(test_dir):
+    """ Regexs merged by column, mixed with regexs using skip_if_no_field and invert """
+    prj = 'kibom-test'
+    ctx = context.TestContextSCH(test_dir, 'test_int_bom_fil_3', prj, 'int_bom_fil_3', BOM_DIR)
+    ctx.run()
+    for name in ['include.csv', 'include_dnf.csv']:
+        rows, header, info = ctx.load_csv(name)
+        ref_column = header.index(REF_COLUMN_NAME)
+        check_kibom_test_netlist(rows, ref_column, 3, ['R4', 'R5', 'R6', 'R8', 'R9', 'R10', 'C3', 'C4'],
+                                 ['R1', 'R2', 'R3', 'R7', 'C1', 'C2'])
+    rows, header, info = ctx.load_csv('exclude.csv')
+    check_kibom_test_netlist(rows, ref_column, 3, ['R4', 'R5', 'R6', 'R7', 'R8', 'C3', 'C4'],
+                             ['R1', 'R2', 'R3', 'R9', 'R10', 'C1', 'C2'])
+    ctx.clean_up()
+
+
 def test_int_bom_variant_t3(test_dir):
     """ Test if we can move the filters to the variant.
         Also test the '!' filter (always false) """
@@ -1637,3 +1675,24 @@ def test_int_bom_subparts_3(test_dir):
     ctx.expect_out_file(output)
     ctx.compare_txt(output, 'subparts-bom.csv')
     ctx.clean_up()
+
+
+def test_int_bom_subparts_4(test_dir):
+    """ The subparts share the fields of the original component (copy-on-write).
+        A BoM without subparts, between two BoMs with subparts, must see the original fields """
+    prj = 'subparts'
+    ctx = context.TestContextSCH(test_dir, 'test_int_bom_subparts_4', prj, 'int_bom_subparts_4', '')
+    ctx.run()
+    for output in [prj+'-bom.csv', prj+'-bom_again.csv']:
+        ctx.expect_out_file(output)
+        ctx.compare_txt(output, 'subparts-bom.csv')
+    rows, header, info = ctx.load_csv(prj+'-bom_plain.csv')
+    ref_column = header.index(REF_COLUMN_NAME)
+    manf_column = header.index('manf#')
+    desc_column = header.index('Description')
+    refs = [ref for r in rows for ref in r[ref_column].split(' ')]
+    assert sorted(refs) == ['HS1', 'J1', 'Q1', 'Q2', 'R1', 'R2', 'R3', 'R4', 'R5']
+    check_value(rows, ref_column, 'Q1', manf_column, '2N2222A PBFREE; 322400B00000G')
+    check_value(rows, ref_column, 'Q1', desc_column, 'TRANS NPN 40V 0.8A TO-18 + Heatsink')
+    check_value(rows, ref_column, 'J1', manf_column, '0022232061;0022012067; 6: 08-50-0114;  LA 55-P; lv 25-P')
+    ctx.clean_up()
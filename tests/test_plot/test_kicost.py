@@ -106,6 +106,37 @@ def test_kicost_bom_sel_dist_1(test_dir):
     ctx.clean_up()
 
 
+def test_kicost_bom_shared_1(test_dir):
+    """ Internal BoM + KiCost, the groups are shared with other BoMs.
+        The `cost_extra_columns` joins must not change them. """
+    prj = 'kibom-variant_2c'
+    ctx = context.TestContextSCH(test_dir, 'test_kicost_bom_shared_1', prj, 'int_bom_kicost_shared_xlsx', OUT_DIR)
+    ctx.run(kicost=True)
+    # The CSV doesn't see the `Resistance`+`Capacitance` join
+    rows, header, info = ctx.load_csv(prj+'-bom_plain.csv')
+    ref_column = header.index('References')
+    res_column = header.index('Resistance')
+    cap_column = header.index('Capacitance')
+    assert len(rows) == 2
+    for r in rows:
+        if r[ref_column] == 'C1 C2':
+            assert r[res_column] == ''
+            assert r[cap_column] == '1000pF'
+        else:
+            assert r[ref_column] == 'R1 R2'
+            assert r[res_column] == '1000'
+    # Both KiCost outputs must be identical
+    contents = []
+    for name in ['', '_again']:
+        output = op.join(OUT_DIR, prj+'-bom'+name+'.xlsx')
+        ctx.expect_out_file(output)
+        convert2csv(ctx.get_out_path(output), sheet='Costs')
+        with open(ctx.get_out_path(output[:-4]+'csv'), 'rt') as f:
+            contents.append(f.read())
+    assert contents[0] == contents[1]
+    ctx.clean_up()
+
+
 def test_kicost_bom_merge_1(test_dir):
     """ Internal BoM + KiCost, merging 3 projects. """
     prj = 'merge_1'
@@ -23,6 +23,9 @@ Tests miscellaneous stuff.
   - already exists
   - Copying
 - Load plugin
+- Compress using threads
+- Compress with deduplication
+- Compress generating the outputs in parallel
 
 For debug information use:
 pytest-3 --log-cli-level debug
@@ -31,7 +34,11 @@ pytest-3 --log-cli-level debug
 import os
 import sys
 import re
+import glob
+import json
 import shutil
+import tarfile
+import zipfile
 import logging
 import subprocess
 # Look for the 'utils' module from where the script is running
@@ -44,7 +51,7 @@ prev_dir = os.path.dirname(prev_dir)
 if prev_dir not in sys.path:
     sys.path.insert(0, prev_dir)
 from kibot.misc import (EXIT_BAD_ARGS, EXIT_BAD_CONFIG, NO_PCB_FILE, NO_SCH_FILE, EXAMPLE_CFG, WONT_OVERWRITE, CORRUPTED_PCB,
-                        PCBDRAW_ERR, NO_PCBNEW_MODULE, NO_YAML_MODULE, INTERNAL_ERROR)
+                        PCBDRAW_ERR, NO_PCBNEW_MODULE, NO_YAML_MODULE, INTERNAL_ERROR, WRONG_ARGUMENTS)
 
 
 POS_DIR = 'positiondir'
@@ -904,6 +911,115 @@ def test_compress_sources_1(test_dir):
     ctx.clean_up()
 
 
+def check_compress_contents(ctx, fname, files):
+    """ Compares the members of a ZIP/TAR archive with the original files """
+    if fname.endswith('.zip'):
+        with zipfile.ZipFile(ctx.get_out_path(fname)) as zip:
+            assert zip.testzip() is None
+            assert sorted(zip.namelist()) == sorted(files.keys())
+            for dest, src in files.items():
+                with open(src, 'rb') as f:
+                    assert zip.read(dest) == f.read(), dest
+    else:
+        with tarfile.open(ctx.get_out_path(fname)) as tar:
+            assert sorted(tar.getnames()) == sorted(files.keys())
+            for dest, src in files.items():
+                with open(src, 'rb') as f:
+                    assert tar.extractfile(dest).read() == f.read(), dest
+    logging.debug(fname+' OK')
+
+
+def test_compress_threads_1(test_dir):
+    """ ZIP and TAR archives compressed using threads, for all the algorithms """
+    prj = 'test_v5'
+    ctx = context.TestContext(test_dir, 'test_compress_threads_1', prj, 'compress_threads_1', '')
+    # A file bigger than the limit for the threads
+    big = ctx.get_out_path('big.bin')
+    with open(big, 'wb') as f:
+        for n in range(1000000):
+            f.write('Line {}\n'.format(n).encode())
+    ctx.run()
+    files = {'source/'+os.path.basename(f): f for f in glob.glob('tests/board_samples/kicad_5/kibom-test*.sch')}
+    files['big/big.bin'] = big
+    for alg, tar_ext in (('stored', 'tar'), ('deflated', 'tar.gz'), ('bzip2', 'tar.bz2'), ('lzma', 'tar.xz')):
+        check_compress_contents(ctx, prj+'-zip_'+alg+'.zip', files)
+        check_compress_contents(ctx, prj+'-tar_'+alg+'.'+tar_ext, files)
+    ctx.clean_up()
+
+
+def create_dedup_files(ctx):
+    """ Three copies of the same file and an unique one """
+    files = {}
+    for name, content in (('a', 'Copy'), ('b', 'Copy'), ('c', 'Copy'), ('d', 'Unique')):
+        fname = ctx.get_out_path(name+'.txt')
+        with open(fname, 'wt') as f:
+            f.write(content+' of a file\n')
+        files['docs/'+name+'.txt'] = fname
+    return files
+
+
+def test_compress_dedup_1(test_dir):
+    """ Identical files stored only once, TAR uses hard links, ZIP a list of the copies """
+    prj = 'test_v5'
+    ctx = context.TestContext(test_dir, 'test_compress_dedup_1', prj, 'compress_dedup_1', '')
+    files = create_dedup_files(ctx)
+    ctx.run()
+    # ZIP: the copies are omitted and listed in the JSON file
+    with zipfile.ZipFile(ctx.get_out_path(prj+'-zip_dedup.zip')) as zip:
+        assert zip.testzip() is None
+        members = zip.namelist()
+        dups = json.loads(zip.read('duplicated_files.json'))
+        members.remove('duplicated_files.json')
+        assert len(dups) == 2
+        assert sorted(members+list(dups.keys())) == sorted(files.keys())
+        for dest, src in files.items():
+            with open(src, 'rb') as f:
+                assert zip.read(dups.get(dest, dest)) == f.read(), dest
+    # TAR: the copies are hard links, extracted as regular files
+    tar_name = ctx.get_out_path(prj+'-tar_dedup.tar.bz2')
+    with tarfile.open(tar_name) as tar:
+        assert len([m for m in tar.getmembers() if m.islnk()]) == 2
+    dest_dir = ctx.get_out_path('extracted')
+    os.makedirs(dest_dir)
+    subprocess.check_call(['tar', 'xf', tar_name, '-C', dest_dir])
+    for dest, src in files.items():
+        with open(src, 'rb') as f, open(os.path.join(dest_dir, dest), 'rb') as e:
+            assert e.read() == f.read(), dest
+    ctx.clean_up()
+
+
+def test_compress_dedup_2(test_dir):
+    """ A file using the name reserved for the list of copies """
+    prj = 'test_v5'
+    ctx = context.TestContext(test_dir, 'test_compress_dedup_2', prj, 'compress_dedup_2', '')
+    create_dedup_files(ctx)
+    with open(ctx.get_out_path('duplicated_files.json'), 'wt') as f:
+        f.write('{}\n')
+    ctx.run(WRONG_ARGUMENTS)
+    ctx.search_err('The `duplicated_files.json` file name is used by the `deduplicate` option')
+    ctx.clean_up()
+
+
+def test_compress_parallel_1(test_dir):
+    """ The outputs needed by compress are generated in parallel (when we have more than one CPU).
+        The warnings and filters stats from the children must be included in the totals """
+    prj = 'RLC_sort'
+    ctx = context.TestContextSCH(test_dir, 'test_compress_parallel_1', prj, 'compress_parallel_1', '')
+    ctx.run()
+    files = ['BoM/'+prj+'-bom.csv', 'BoM/'+prj+'-bom.html', 'BoM/'+prj+'-bom.xml']
+    ctx.test_compress(prj+'-result.zip', files)
+    # The same warnings are generated by all the BoMs, no matters which process generated them
+    ctx.search_err(r'Malformed value: .?10Q.?')
+    warnings = set(re.findall(r'^WARNING:(.*)$', ctx.err, re.MULTILINE))
+    m = ctx.search_out(r'Found (\d+) unique warning/s \((\d+) total')
+    assert int(m.group(1)) == len(warnings)
+    assert int(m.group(2)) >= len(warnings)
+    # The filters applied by the children are in the stats
+    ctx.search_out('Filters and variants statistics:')
+    ctx.search_out(r'_mechanical\s+\d+')
+    ctx.clean_up()
+
+
 def test_date_format_1(test_dir):
     """ Date from SCH reformated """
     prj = 'test_v5'
@@ -3,8 +3,12 @@ import sys
 import re
 import pytest
 import coverage
+import time
+import signal
 import logging
+import zipfile
 import subprocess
+from multiprocessing import get_context
 # Look for the 'utils' module from where the script is running
 prev_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if prev_dir not in sys.path:
@@ -27,6 +31,10 @@ from kibot.bom.units import get_prefix
 from kibot.__main__ import detect_kicad
 from kibot.kicad.config import KiConf
 from kibot.globals import Globals
+from kibot.kicad.pcb import PCB
+from kibot.display_pool import DisplayPool
+import kibot.out_compress
+from kibot.out_compress import _read_compressed
 
 cov = coverage.Coverage()
 mocked_check_output_FNF = True
@@ -338,3 +346,175 @@ def test_makefile_kibot_sys(test_dir):
         generate_makefile(ctx.get_out_path('Makefile'), 'pp', [], kibot_sys=True)
     ctx.search_in_file('Makefile', [r'KIBOT\?=kibot'])
     ctx.clean_up()
+
+
+def display_pool_worker(pool, queue):
+    with pool.environment() as env:
+        queue.put(env['DISPLAY'])
+        # Keep the display busy, so the other process must use another one
+        time.sleep(0.5)
+
+
+def test_display_pool(caplog):
+    """ Pool of virtual displays, using a fake Xvfb """
+    xvfb = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_xvfb', 'Xvfb')
+    with context.cover_it(cov):
+        pool = DisplayPool(2, xvfb)
+        pids = [d.proc.pid for d in pool.displays]
+        names = [d.name for d in pool.displays]
+        assert len(set(names)) == 2
+        # Two processes using the pool at the same time get different displays
+        ctx = get_context('fork')
+        queue = ctx.Queue()
+        procs = [ctx.Process(target=display_pool_worker, args=(pool, queue)) for _ in range(2)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+            assert p.exitcode == 0
+        assert sorted(queue.get() for _ in procs) == sorted(names)
+        # A dead server is restarted
+        d = pool.displays[0]
+        d.proc.send_signal(signal.SIGTERM)
+        d.proc.wait()
+        assert len(pool.healthy()) == 2
+        assert d.proc.pid not in pids
+        pids.append(d.proc.pid)
+        sockets = ['/tmp/.X11-unix/X{}'.format(d.number) for d in pool.displays]
+        pool.close()
+    # No servers left
+    for pid in pids:
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+    for sock in sockets:
+        assert not os.path.exists(sock)
+    assert not os.path.isdir(pool.lock_dir)
+    # A pool that can't start the servers isn't used
+    with context.cover_it(cov):
+        pool = DisplayPool(1, xvfb+'_bogus')
+        with pool.environment() as env:
+            assert env is None
+        pool.close()
+    assert 'Unable to start' in caplog.text
+
+
+def create_compress(ctx, options):
+    """ Creates a compress output for the *.txt files in the output dir """
+    load_actions()
+    init_globals()
+    out = RegOutput.get_class_for('compress')()
+    out.set_tree({'options': dict({'files': [{'source': '*.txt'}]}, **options)})
+    out.config(None)
+    GS.out_dir = ctx.get_out_path('')
+    return out
+
+
+def write_inc_file(ctx, name, content):
+    with open(ctx.get_out_path(name), 'wt') as f:
+        f.write((content+'\n')*1000)
+
+
+def read_raw_members(fname):
+    """ Compressed data for the members of a ZIP file """
+    with zipfile.ZipFile(fname) as zip:
+        return {m.filename: b''.join(_read_compressed(zip, m)[0]) for m in zip.infolist()}
+
+
+def test_compress_incremental(test_dir, caplog, monkeypatch):
+    """ Incremental ZIP archives """
+    caplog.set_level(logging.DEBUG)
+    ctx = context.TestContext(test_dir, 'test_compress_incremental', 'test_v5', 'empty_zip', '')
+    for n in range(4):
+        write_inc_file(ctx, 'f{}.txt'.format(n), 'File {}'.format(n))
+    archive = ctx.get_out_path('result.zip')
+    manifest = archive+'.manifest'
+    # Count the files compressed
+    compressed = []
+    compress_member = kibot.out_compress._compress_member
+    monkeypatch.setattr(kibot.out_compress, '_compress_member', lambda f, *args: compressed.append(f) or
+                        compress_member(f, *args))
+    with context.cover_it(cov):
+        out = create_compress(ctx, {'incremental': True, 'threads': 2})
+        # First run: all the files
+        out.options.run(archive)
+        assert len(compressed) == 4
+        assert os.path.isfile(manifest)
+        raw = read_raw_members(archive)
+        # Nothing changed: the archive isn't touched
+        compressed.clear()
+        mtime = os.path.getmtime(archive)
+        out.options.run(archive)
+        assert not compressed
+        assert os.path.getmtime(archive) == mtime
+        assert '`{}` is up to date'.format(archive) in caplog.text
+        # One file changed: only this file is compressed, the rest is copied byte by byte
+        write_inc_file(ctx, 'f2.txt', 'Changed')
+        out.options.run(archive)
+        assert compressed == [os.path.realpath(ctx.get_out_path('f2.txt'))]
+        new_raw = read_raw_members(archive)
+        assert sorted(new_raw.keys()) == sorted(raw.keys())
+        for name in ('f0.txt', 'f1.txt', 'f3.txt'):
+            assert new_raw[name] == raw[name], name
+        assert new_raw['f2.txt'] != raw['f2.txt']
+        # The options changed: a new archive
+        compressed.clear()
+        out = create_compress(ctx, {'incremental': True, 'threads': 2, 'compression_level': 1})
+        out.options.run(archive)
+        assert len(compressed) == 4
+        # The archive was removed, but we have the manifest
+        compressed.clear()
+        os.remove(archive)
+        out.options.run(archive)
+        assert len(compressed) == 4
+    with zipfile.ZipFile(archive) as zip:
+        assert zip.testzip() is None
+        assert zip.read('f2.txt') == b'Changed\n'*1000
+    ctx.clean_up()
+
+
+def check_pcb_parser(version):
+    """ Compares the data from the PCB parser with the values obtained using pcbnew.
+        The XYRS file was generated using pcbnew, the rest is from the report (light_control-report.txt) """
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with context.cover_it(cov):
+        pcb = PCB.load(os.path.join(base_dir, 'board_samples', 'kicad_'+version, 'light_control.kicad_pcb'))
+    # Footprints: 61 SMD, 12 THT and 4 virtual, all in the top side
+    assert len(pcb.footprints) == 77
+    assert sum(fp.smd for fp in pcb.footprints) == 61
+    assert sum(fp.tht for fp in pcb.footprints) == 12
+    assert sum(fp.virtual for fp in pcb.footprints) == 4
+    assert not any(fp.bottom for fp in pcb.footprints)
+    # Layers
+    assert [la.name for la in pcb.layers if la.name.endswith('.Cu')] == ['F.Cu', 'In1.Cu', 'In2.Cu', 'B.Cu']
+    # Tracks and vias, grouped by size
+    widths = {}
+    for t in pcb.tracks:
+        widths[t.width] = widths.get(t.width, 0)+1
+    assert widths == {152400: 276, 304800: 11, 635000: 175}
+    vias = {}
+    for v in pcb.vias:
+        vias[(v.size, v.drill)] = vias.get((v.size, v.drill), 0)+1
+    assert vias == {(508000, 254000): 23, (889000, 508000): 33}
+    # Position, side, type and size of the pads box, in mils and relative to the auxiliary origin
+    fps = pcb.get_footprints_hash()
+    ox, oy = pcb.aux_origin
+    with open(os.path.join(base_dir, 'reference', '5_1_6', 'light_control.XYRS'), 'rt') as f:
+        rows = [r.split('\t') for r in f.read().splitlines()]
+    for r in rows:
+        fp = fps[r[0]]
+        w, h = fp.get_pads_size(local=(version == '6'))
+        assert '{:.4f}'.format((fp.x-ox)/25400) == r[1], r[0]
+        assert '{:.4f}'.format(-(fp.y-oy)/25400) == r[2], r[0]
+        assert ('bottom' if fp.bottom else 'top') == r[4], r[0]
+        assert fp.layer == 'F.Cu'
+        assert ('0' if fp.virtual else '2' if fp.tht else '1') == r[5], r[0]
+        assert '{:.4f}'.format(w/25400) == r[6], r[0]
+        assert '{:.4f}'.format(h/25400) == r[7], r[0]
+
+
+def test_pcb_parser_5():
+    check_pcb_parser('5')
+
+
+def test_pcb_parser_6():
+    check_pcb_parser('6')